@@ -5,15 +5,76 @@ import requests
 from settings import settings
 
 
-def find(query: str) -> tuple[list[dict], str | None]:
+CONNECTION_ERROR = "Can't connect to the munchkin server. Is it running? Run mckn start to start it if you haven't."
+
+
+def _params(**params) -> dict:
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def find(
+    query: str,
+    extension: str | None = None,
+    folder: str | None = None,
+    min_size: int | None = None,
+    max_size: int | None = None,
+    modified_after: float | None = None,
+    modified_before: float | None = None,
+) -> tuple[list[dict], str | None]:
+    """Sizes are in bytes and modification times are unix timestamps"""
     try:
         res = requests.get(
-            f"http://localhost:{settings.get_daemon_port()}/query", {"query": query}
+            f"http://localhost:{settings.get_daemon_port()}/query",
+            _params(
+                query=query,
+                extension=extension,
+                folder=folder,
+                min_size=min_size,
+                max_size=max_size,
+                modified_after=modified_after,
+                modified_before=modified_before,
+            ),
         )
         logging.info(f"Find request returned response: {res.text}")
         return res.json(), None
     except requests.ConnectionError:
-        return (
-            [],
-            "Can't connect to the munchkin server. Is it running? Run mckn start to start it if you haven't.",
+        return [], CONNECTION_ERROR
+
+
+def find_page(
+    query: str,
+    cursor: str | None = None,
+    page_size: int = 10,
+    extension: str | None = None,
+    folder: str | None = None,
+    min_size: int | None = None,
+    max_size: int | None = None,
+    modified_after: float | None = None,
+    modified_before: float | None = None,
+) -> tuple[list[dict], str | None, str | None]:
+    """
+    A page of results, the cursor to pass for the next page (None on the last
+    page) and an error
+    """
+    try:
+        res = requests.get(
+            f"http://localhost:{settings.get_daemon_port()}/query/page",
+            _params(
+                query=query,
+                cursor=cursor,
+                page_size=page_size,
+                extension=extension,
+                folder=folder,
+                min_size=min_size,
+                max_size=max_size,
+                modified_after=modified_after,
+                modified_before=modified_before,
+            ),
         )
+        logging.info(f"Find page request returned response: {res.text}")
+        if not res.ok:
+            return [], None, res.json().get("detail", res.text)
+        page = res.json()
+        return page["files"], page["cursor"], None
+    except requests.ConnectionError:
+        return [], None, CONNECTION_ERROR
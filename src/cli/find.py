@@ -1,13 +1,66 @@
+import datetime as dt
+import re
+
 import click
 
 import api.find
 
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_size(ctx, param, value: str | None) -> int | None:
+    """Parse sizes like 512, 10k, 1.5M or 2GB into bytes"""
+    if value is None:
+        return None
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*", value.lower())
+    if match is None:
+        raise click.BadParameter(f"'{value}' is not a size, e.g. 500k or 10MB")
+    return int(float(match[1]) * SIZE_UNITS[match[2]])
+
+
+def timestamp(value: dt.datetime | None) -> float | None:
+    return value.timestamp() if value is not None else None
+
 
 @click.command()
 @click.argument("query")
-def find(query: str):
+@click.option("--ext", help="Only files with this extension, e.g. pdf.")
+@click.option(
+    "--folder",
+    type=click.Path(file_okay=False, resolve_path=True),
+    help="Only files in this folder or its subfolders.",
+)
+@click.option("--min-size", callback=parse_size, help="Smallest file size, e.g. 10k.")
+@click.option("--max-size", callback=parse_size, help="Largest file size, e.g. 5MB.")
+@click.option(
+    "--after",
+    type=click.DateTime(),
+    help="Only files modified on or after this date.",
+)
+@click.option(
+    "--before",
+    type=click.DateTime(),
+    help="Only files modified before this date.",
+)
+def find(
+    query: str,
+    ext: str | None,
+    folder: str | None,
+    min_size: int | None,
+    max_size: int | None,
+    after: dt.datetime | None,
+    before: dt.datetime | None,
+):
     """Semantic search for files using a QUERY string and return file paths."""
-    res, err = api.find.find(query)
+    res, err = api.find.find(
+        query,
+        extension=ext,
+        folder=folder,
+        min_size=min_size,
+        max_size=max_size,
+        modified_after=timestamp(after),
+        modified_before=timestamp(before),
+    )
 
     if err:
         raise click.ClickException(err)
@@ -4,13 +4,16 @@ import time
 
 import pystray
 import uvicorn
-from fastapi import APIRouter, FastAPI
+from fastapi import APIRouter, FastAPI, HTTPException
 from PIL import Image, ImageDraw
 from watchdog.observers import Observer
-from watchdog.observers.api import BaseObserver
+from watchdog.observers.api import ObservedWatch
 
 from engine.db.database import VectorDatabase
-from engine.queryprocessor import QueryProcessor
+from engine.db.filters import QueryFilters
+from engine.pipeline import Pipeline
+from engine.queryprocessor import InvalidCursorError, QueryProcessor
+from engine.reconciler import Reconciler
 from engine.saveprocessor import SaveProcessor
 from engine.watcher import WatcherHandler
 from settings import ASSETS_DIR, BASE_DIR, settings
@@ -20,17 +23,26 @@ class DaemonService:
     def __init__(self):
         self.is_dead = threading.Event()
         self.tray_icon = None
-        self.watchers: dict[str, BaseObserver] = {}
+        self.watches: dict[str, ObservedWatch] = {}
+        self.watches_lock = threading.Lock()
         self.router = APIRouter()
         self.router.add_api_route("/shutdown", self.shutdown, methods=["POST"])
         self.router.add_api_route("/ping", lambda: "mckndaemon", methods=["GET"])
         self.router.add_api_route("/refresh", self.refresh, methods=["POST"])
         self.router.add_api_route("/query", self.query)
+        self.router.add_api_route("/query/page", self.query_page)
+        self.router.add_api_route("/reconcile", self.reconcile_status, methods=["GET"])
+        self.router.add_api_route("/stats", self.stats, methods=["GET"])
         self.app = FastAPI()
         self.app.include_router(self.router)
-        db = VectorDatabase()
-        self.saveprocessor = SaveProcessor(db)
-        self.queryprocessor = QueryProcessor(db)
+        self.db = VectorDatabase()
+        self.saveprocessor = SaveProcessor(self.db, settings.get_token_threshold())
+        self.pipeline = Pipeline(self.saveprocessor)
+        self.event_handler = WatcherHandler(self.pipeline)
+        self.observer = Observer()
+        self.queryprocessor = QueryProcessor(self.db)
+        self.reconciler = Reconciler(self.db, self.is_dead)
+        settings.subscribe(self.__on_settings_changed)
 
     # API Routes
 
@@ -39,11 +51,52 @@ class DaemonService:
         self.is_dead.set()
 
     def refresh(self):
-        self.__clear_observers()
-        self.__populate_observers()
+        self.__sync_watches()
+
+    def query(
+        self,
+        query: str,
+        return_length: int = 5,
+        extension: str | None = None,
+        folder: str | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+        modified_after: float | None = None,
+        modified_before: float | None = None,
+    ):
+        filters = QueryFilters(
+            extension, folder, min_size, max_size, modified_after, modified_before
+        )
+        return self.queryprocessor.process_query(query, return_length, filters)
+
+    def query_page(
+        self,
+        query: str,
+        page_size: int = 5,
+        cursor: str | None = None,
+        extension: str | None = None,
+        folder: str | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+        modified_after: float | None = None,
+        modified_before: float | None = None,
+    ):
+        filters = QueryFilters(
+            extension, folder, min_size, max_size, modified_after, modified_before
+        )
+        try:
+            files, next_cursor = self.queryprocessor.process_query_page(
+                query, page_size, cursor, filters
+            )
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"files": files, "cursor": next_cursor}
 
-    def query(self, query: str, return_length: int = 5):
-        return self.queryprocessor.process_query(query, return_length)
+    def reconcile_status(self):
+        return self.reconciler.status()
+
+    def stats(self):
+        return self.pipeline.stats.snapshot()
 
     def __create_image(self):
         try:
@@ -56,24 +109,36 @@ class DaemonService:
             dc.ellipse((16, 16, 48, 48), fill=(0, 0, 0))
             return image
 
-    def __populate_observers(self):
-        watch_paths = settings.get_watch_paths()
-        logging.info(f"Watching directories: {watch_paths}")
-
-        for watch_path in watch_paths:
-            observer = Observer()
-            event_handler = WatcherHandler(self.saveprocessor)
-            observer.schedule(event_handler, watch_path)
-            observer.start()
-            self.watchers[watch_path] = observer
-
-    def __clear_observers(self):
-        logging.info("Stopping observers...")
-        for observer in self.watchers.values():
-            observer.stop()
-        for observer in self.watchers.values():
-            observer.join()
-        logging.info("Observers stopped.")
+    def __on_settings_changed(self, keys: set[str]):
+        # The observer isn't running yet during startup, it syncs once it is.
+        # Subscribers run on whichever thread read the settings, which may be
+        # __sync_watches itself while it holds watches_lock, so sync off it.
+        if "watch_paths" in keys and self.observer.is_alive():
+            threading.Thread(target=self.__sync_watches, daemon=True).start()
+
+    def __sync_watches(self):
+        """Schedule new watch paths and unschedule removed ones on the shared observer"""
+        with self.watches_lock:
+            watch_paths = set(settings.get_watch_paths())
+            for watch_path in self.watches.keys() - watch_paths:
+                self.observer.unschedule(self.watches.pop(watch_path))
+                logging.info(f"Stopped watching directory: {watch_path}")
+            for watch_path in watch_paths - self.watches.keys():
+                try:
+                    self.watches[watch_path] = self.observer.schedule(
+                        self.event_handler, watch_path
+                    )
+                    logging.info(f"Watching directory: {watch_path}")
+                except OSError as e:
+                    logging.error(f"Failed to watch directory {watch_path}: {e}")
+
+    def __stop_observer(self):
+        logging.info("Stopping observer...")
+        self.observer.stop()
+        self.observer.join()
+        self.event_handler.stop()
+        self.watches.clear()
+        logging.info("Observer stopped.")
 
     def __watch_directories(self):
         """
@@ -81,9 +146,20 @@ class DaemonService:
         """
         logging.info("Starting service")
 
-        self.__populate_observers()
+        self.pipeline.start()
+        self.observer.start()
+        self.__sync_watches()
+        # Warm up once files are being watched, so saves made meanwhile aren't missed
+        try:
+            self.db.embedder.warm_up()
+        except Exception as e:
+            logging.error(f"Failed to load embedding model: {e}")
+        self.reconciler.start()
         self.is_dead.wait()
-        self.__clear_observers()
+        self.pipeline.stop()
+        self.__stop_observer()
+        self.reconciler.thread.join()
+        self.db.close()
 
     def __start_server(self):
         """Start the lightweight fastapi server"""
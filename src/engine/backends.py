@@ -0,0 +1,25 @@
+import itertools
+
+from engine.model_api import ModelAPI, ModelBackend
+from engine.stub_model import StubModel
+from settings import settings
+
+# Numbers the stub models created, so each one draws its own latencies and errors
+_stub_count = itertools.count()
+
+
+def create_model(
+    temperature: float = 0.0, response_mime_type: str | None = None
+) -> ModelBackend:
+    """The model backend selected in settings, "gemini" or "stub" """
+    backend = settings.get_model_backend()
+    if backend["name"] == "stub":
+        stub = backend["stub"]
+        # Models are created in the same order on every run, so this is repeatable
+        seed = f"{stub['seed']}:{next(_stub_count)}"
+        return StubModel(
+            stub["latency_ms"], stub["latency_sigma"], stub["error_rate"], seed
+        )
+    if backend["name"] == "gemini":
+        return ModelAPI(backend["model_name"], temperature, response_mime_type)
+    raise ValueError(f"Unknown model backend: {backend['name']}")
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from engine.watcher import File
+from settings import BASE_DIR, settings
+
+CACHE_FILE = BASE_DIR / "munchkin_cache.db"
+
+
+def content_hash(file: File) -> str:
+    """Hash of the file's content, streamed so large files are never held in memory"""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in file.iter_chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def folder_paths_key(folder_paths: dict[str, str]) -> str:
+    """Fingerprint of the folder associations a classification was made against"""
+    encoded = json.dumps(folder_paths, sort_keys=True).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class CacheEntry:
+    def __init__(
+        self,
+        text: str | None,
+        summary: str | None,
+        folder: str | None,
+        folder_key: str | None,
+    ):
+        self.text = text
+        self.summary = summary
+        self.folder = folder
+        self.folder_key = folder_key
+
+    def is_classified(self, folder_paths: dict[str, str]) -> bool:
+        """Classifications are only valid for the folder paths they were made for"""
+        return self.folder_key == folder_paths_key(folder_paths)
+
+
+class ResultCache:
+    """
+    On-disk cache of extraction, summary and classification results keyed by the
+    content hash of the file. Least recently used rows are evicted once the
+    cached text exceeds the configured size.
+    """
+
+    def __init__(self, path: Path = CACHE_FILE, max_bytes: int | None = None):
+        self.max_bytes = max_bytes or settings.get_cache_max_bytes()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    hash TEXT PRIMARY KEY,
+                    text TEXT,
+                    summary TEXT,
+                    folder TEXT,
+                    folder_key TEXT,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+            )
+
+    def get(self, hash: str) -> CacheEntry | None:
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT text, summary, folder, folder_key FROM results WHERE hash = ?",
+                (hash,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE results SET last_used = ? WHERE hash = ?", (time.time(), hash)
+            )
+        return CacheEntry(*row)
+
+    def put_text(self, hash: str, text: str):
+        self.__upsert(hash, "text", text)
+
+    def put_summary(self, hash: str, summary: str):
+        self.__upsert(hash, "summary", summary)
+
+    def put_folder(self, hash: str, folder: str | None, folder_paths: dict[str, str]):
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO results (hash, folder, folder_key, last_used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (hash) DO UPDATE SET
+                    folder = excluded.folder,
+                    folder_key = excluded.folder_key,
+                    last_used = excluded.last_used
+                """,
+                (hash, folder, folder_paths_key(folder_paths), time.time()),
+            )
+
+    def __upsert(self, hash: str, column: str, value: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"""
+                INSERT INTO results (hash, {column}, last_used) VALUES (?, ?, ?)
+                ON CONFLICT (hash) DO UPDATE SET
+                    {column} = excluded.{column},
+                    last_used = excluded.last_used
+                """,
+                (hash, value, time.time()),
+            )
+            self.conn.execute(
+                """
+                UPDATE results
+                SET size = length(coalesce(text, '')) + length(coalesce(summary, ''))
+                WHERE hash = ?
+                """,
+                (hash,),
+            )
+            self.__evict()
+
+    def __evict(self):
+        # Drop everything past the most recently used max_bytes worth of rows
+        self.conn.execute(
+            """
+            DELETE FROM results WHERE hash IN (
+                SELECT hash FROM (
+                    SELECT hash, SUM(size) OVER (ORDER BY last_used DESC) AS running
+                    FROM results
+                )
+                WHERE running > ?
+            )
+            """,
+            (self.max_bytes,),
+        )
@@ -1,17 +1,75 @@
+import asyncio
+import json
+import logging
+import threading
 from pathlib import Path
+from typing import Callable
 
-from engine.model_api import ModelAPI
+import numpy as np
+
+from engine.backends import create_model
+from engine.cache import folder_paths_key
+from engine.db.database import VectorDatabase
+from engine.db.embedding import EmbeddingEngine
+from engine.local_classifier import CentroidClassifier
 from engine.prompt_builder import (
+    build_batch_classification_prompt,
+    build_batch_summarization_prompt,
     build_classification_prompt,
+    build_combined_prompt,
     build_summarization_prompt,
 )
 from settings import settings
 
 
+def _load_json(response: str):
+    response = response.strip()
+    # Models sometimes wrap JSON in a markdown code fence
+    if response.startswith("```"):
+        response = response.strip("`").removeprefix("json").strip()
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Malformed JSON response: {response}") from e
+
+
+def _parse_batch_response(response: str, field: str, count: int) -> list[str]:
+    """
+    Demultiplex a batched answer of the form [{"id": 0, field: "..."}, ...].
+    Every id in range(count) must appear exactly once.
+    """
+    result = _load_json(response)
+    if not isinstance(result, list) or len(result) != count:
+        raise ValueError(f"Expected a list of {count} answers: {response}")
+    answers: dict[int, str] = {}
+    for item in result:
+        if not isinstance(item, dict):
+            raise ValueError(f"Malformed answer in batch: {item}")
+        id, value = item.get("id"), item.get(field)
+        if not isinstance(id, int) or not 0 <= id < count or id in answers:
+            raise ValueError(f"Unexpected id in batch: {item}")
+        if not isinstance(value, str):
+            raise ValueError(f"Missing {field} in batch: {item}")
+        answers[id] = value
+    return [answers[id] for id in range(count)]
+
+
+def _each(fn: Callable, items: list) -> list:
+    """fn of every item, with the exception in place of the result where it raised"""
+    results = []
+    for item in items:
+        try:
+            results.append(fn(item))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
 class Summarizer:
     def __init__(self):
-        self.summarization_model = ModelAPI(
-            model_name="gemini-2.0-flash", temperature=0.3
+        self.summarization_model = create_model(temperature=0.3)
+        self.batch_model = create_model(
+            temperature=0.3, response_mime_type="application/json"
         )
 
     def summarize(self, contents: str):
@@ -19,11 +77,93 @@ class Summarizer:
         summary = self.summarization_model.call(prompt)
         return summary.strip()
 
+    async def asummarize(self, contents: str):
+        prompt = build_summarization_prompt(contents)
+        summary = await self.summarization_model.acall(prompt)
+        return summary.strip()
+
+    def summarize_batch(self, contents: list[str]) -> list[str | Exception]:
+        """
+        Summarize several files with one call, retrying one by one when the call
+        fails or its answer is malformed. Files that then fail on their own get the
+        exception instead.
+        """
+        if len(contents) > 1:
+            prompt = build_batch_summarization_prompt(contents)
+            try:
+                summaries = _parse_batch_response(
+                    self.batch_model.call(prompt), "summary", len(contents)
+                )
+                return [summary.strip() for summary in summaries]
+            except Exception as e:
+                logging.warning(f"Retrying batch of {len(contents)} one by one: {e}")
+        return _each(self.summarize, contents)
+
+
+class FolderMatcher:
+    """
+    Matches summaries to destination folders by embedding similarity, answering
+    only when one folder clearly beats the runner-up. Folder embeddings are
+    computed once per set of folder associations.
+    """
+
+    def __init__(self, embedder: EmbeddingEngine):
+        self.embedder = embedder
+        self.folders_key: str | None = None
+        self.paths: list[str] = []
+        self.embeddings = np.empty((0, 0))
+        self.lock = threading.Lock()
+
+    def match(
+        self, summary_embedding: np.ndarray, folder_paths: dict[str, str]
+    ) -> str | None:
+        config = settings.get_embedding_classification()
+        paths, embeddings = self.__folder_embeddings(folder_paths)
+        if not paths:
+            return None
+        similarities = embeddings @ (
+            summary_embedding / np.linalg.norm(summary_embedding)
+        )
+        ranked = np.argsort(similarities)[::-1]
+        best = similarities[ranked[0]]
+        runner_up = similarities[ranked[1]] if len(ranked) > 1 else 0.0
+        if best < config["min_similarity"] or best - runner_up < config["margin"]:
+            return None
+        return paths[ranked[0]]
+
+    def __folder_embeddings(
+        self, folder_paths: dict[str, str]
+    ) -> tuple[list[str], np.ndarray]:
+        key = folder_paths_key(folder_paths)
+        with self.lock:
+            if key != self.folders_key:
+                self.paths = list(folder_paths.keys())
+                self.embeddings = np.empty((0, 0))
+                if self.paths:
+                    embeddings = np.array(
+                        self.embedder.embed_documents(
+                            [
+                                f"{Path(path).name}: {description}"
+                                for path, description in folder_paths.items()
+                            ]
+                        )
+                    )
+                    self.embeddings = embeddings / np.linalg.norm(
+                        embeddings, axis=1, keepdims=True
+                    )
+                self.folders_key = key
+            return self.paths, self.embeddings
+
 
 class Classifier:
-    def __init__(self):
-        self.classification_model = ModelAPI(
-            model_name="gemini-2.0-flash", temperature=0.0
+    def __init__(self, db: VectorDatabase | None = None):
+        # Classify confident matches locally when enabled, before asking the model
+        self.embedder = db.embedder if db is not None else None
+        self.matcher = FolderMatcher(db.embedder) if db is not None else None
+        self.centroids = CentroidClassifier(db) if db is not None else None
+        self.classification_model = create_model(temperature=0.0)
+        self.combined_model = create_model(
+            temperature=0.0, response_mime_type="application/json"
         )
 
     def classify(self, file_name: str, summary: str) -> str | None:
@@ -33,12 +173,110 @@ class Classifier:
         """
         folder_paths = settings.get_folder_paths()
 
+        matched = self._match_locally(summary, folder_paths)
+        if matched is not None:
+            return matched
+
         classification_response = self._classify_file(summary, file_name, folder_paths)
 
         validated_path = self._validate_response(classification_response, folder_paths)
 
         return validated_path
 
+    async def aclassify(self, file_name: str, summary: str) -> str | None:
+        """Async counterpart of classify, with the same guarantees"""
+        folder_paths = settings.get_folder_paths()
+        # Embedding the summary is blocking work, keep it off the event loop
+        matched = await asyncio.to_thread(self._match_locally, summary, folder_paths)
+        if matched is not None:
+            return matched
+        classification_prompt = build_classification_prompt(
+            summary, file_name, folder_paths
+        )
+        response = await self.classification_model.acall(classification_prompt)
+        return self._validate_response(response, folder_paths)
+
+    def classify_batch(
+        self, files: list[tuple[str, str]]
+    ) -> list[str | None | Exception]:
+        """
+        Classify several (file_name, summary) pairs with one call, retrying one by
+        one when the call fails or its answer is malformed. Every path returned is
+        validated like classify, files that fail on their own get the exception
+        instead.
+        """
+        folder_paths = settings.get_folder_paths()
+        results = [self._match_locally(summary, folder_paths) for _, summary in files]
+        pending = [i for i, result in enumerate(results) if result is None]
+        responses = None
+        if len(pending) > 1:
+            prompt = build_batch_classification_prompt(
+                [files[i] for i in pending], folder_paths
+            )
+            try:
+                responses = _parse_batch_response(
+                    self.combined_model.call(prompt), "folder", len(pending)
+                )
+            except Exception as e:
+                logging.warning(f"Retrying batch of {len(pending)} one by one: {e}")
+        if responses is None:
+            responses = _each(
+                lambda i: self._classify_file(files[i][1], files[i][0], folder_paths),
+                pending,
+            )
+        for i, response in zip(pending, responses):
+            if isinstance(response, Exception):
+                results[i] = response
+            else:
+                results[i] = self._validate_response(response, folder_paths)
+        return results
+
+    def summarize_and_classify(
+        self, file_name: str, contents: str
+    ) -> tuple[str, str | None]:
+        """
+        Summarize and classify the file with a single model call.
+        Raises ValueError if the model does not answer with the expected JSON object.
+        """
+        folder_paths = settings.get_folder_paths()
+        prompt = build_combined_prompt(contents, file_name, folder_paths)
+        response = self.combined_model.call(prompt)
+        summary, folder = self._parse_combined_response(response)
+        return summary, self._validate_response(folder, folder_paths)
+
+    def _parse_combined_response(self, response: str) -> tuple[str, str]:
+        result = _load_json(response)
+        if not isinstance(result, dict):
+            raise ValueError(f"Malformed combined response: {response}")
+        summary, folder = result.get("summary"), result.get("folder")
+        if not isinstance(summary, str) or not summary.strip():
+            raise ValueError(f"Missing summary in combined response: {response}")
+        if not isinstance(folder, str):
+            raise ValueError(f"Missing folder in combined response: {response}")
+        return summary.strip(), folder
+
+    def _match_locally(self, summary: str, folder_paths: dict[str, str]) -> str | None:
+        """A confident local match, or None to ask the model"""
+        if self.embedder is None:
+            return None
+        use_descriptions = settings.get_embedding_classification()["enabled"]
+        use_centroids = settings.get_local_classifier()["enabled"]
+        if not use_descriptions and not use_centroids:
+            return None
+        try:
+            embedding = self.embedder.embed_documents([summary])[0]
+            folder = None
+            if use_centroids:
+                folder = self.centroids.predict(embedding, folder_paths)
+            if folder is None and use_descriptions:
+                folder = self.matcher.match(embedding, folder_paths)
+        except Exception as e:
+            logging.warning(f"Falling back to the model, local matching failed: {e}")
+            return None
+        if folder is None:
+            return None
+        return self._validate_response(folder, folder_paths)
+
     def _classify_file(
         self, summary: str, file_name: str, folder_paths: dict[str, str]
     ) -> str:
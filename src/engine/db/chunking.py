@@ -0,0 +1,12 @@
+def split_chunks(text: str, words: int, overlap: int, max_chunks: int) -> list[str]:
+    """Split normalized text into windows of `words` words overlapping by `overlap`"""
+    tokens = text.split()
+    step = max(1, words - overlap)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        if len(chunks) == max_chunks:
+            break
+        chunks.append(" ".join(tokens[start : start + words]))
+        if start + words >= len(tokens):
+            break
+    return chunks
@@ -1,20 +1,153 @@
+import datetime as dt
+import hashlib
+import json
 import logging
-import uuid
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable
 
 import chromadb
 import chromadb.api
 import chromadb.api.types
+import chromadb.errors
 
 import engine.db.models as models
+from engine.db.chunking import split_chunks
+from engine.db.embedding import DEFAULT_MODEL, EmbeddingEngine
+from engine.db.filters import QueryFilters
+from engine.db.lexical import LexicalIndex
 from engine.watcher import File
+from settings import BASE_DIR, settings
 
 DISTANCE_THRESHOLD = 1.7
+# Reciprocal rank fusion constant, damps the weight of the top few ranks
+RRF_K = 60
+# Single terms like "hw1_linked_lists", "INV-20931" or "report.pdf"
+IDENTIFIER = re.compile(r"\S*[\d_.\-]\S*")
+JOURNAL_FILE = BASE_DIR / "munchkin_pending.jsonl"
+# Entries that can't be written are set aside here, see VectorDatabase.flush
+QUARANTINE_FILE = BASE_DIR / "munchkin_quarantine.jsonl"
+# Times an entry may fail to be written, while others succeed, before it is set aside
+MAX_WRITE_ATTEMPTS = 3
+COLLECTION = "munchkin_files"
+CHUNK_COLLECTION = "munchkin_chunks"
+# Chunk hits fetched per requested result, several usually belong to one file
+CHUNK_FANOUT = 8
+
+
+def _timestamp(value: float | None) -> str | None:
+    return dt.datetime.fromtimestamp(value).isoformat() if value is not None else None
+
+
+def to_model(document: str, metadata: dict) -> models.File:
+    """Build the query result for a row, file metadata is read from the index"""
+    return models.File(
+        summary=document,
+        name=metadata["basename"],
+        path=metadata["path"],
+        extension=metadata["extension"],
+        size_bytes=metadata.get("size_bytes"),
+        created_at=_timestamp(metadata.get("ctime")),
+        modified_at=_timestamp(metadata.get("mtime")),
+    )
+
+
+def document_id(path: str) -> str:
+    """Stable id of the document for a file, derived from its normalized path"""
+    normalized = os.path.normcase(str(Path(path).resolve()))
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class WriteJournal:
+    """
+    Append-only log of buffered entries. Entries are fsynced before create_entry
+    returns and dropped from the log once they are committed to the collection,
+    so a crash never loses an acknowledged entry.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, entry: dict):
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def read(self) -> list[dict]:
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn write from a crash, the entry was never acknowledged
+                    continue
+        return entries
+
+    def rewrite(self, entries: list[dict]):
+        """
+        Replace the log with entries, the ones still pending. The new log is
+        written aside and swapped in, so a crash leaves either the old or the new.
+        """
+        fd, tmp = tempfile.mkstemp(dir=Path(self.path).parent, prefix=".pending.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.file.close()
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self.file.close()
+
 
 class VectorDatabase:
     def __init__(self):
-        self.collection = chromadb.PersistentClient().get_or_create_collection(
-            "munchkin_files"
+        embedding = settings.get_embedding()
+        self.embedder = EmbeddingEngine(
+            embedding["model"],
+            embedding["batch_size"],
+            embedding["threads"],
+            embedding["query_cache_size"],
         )
+        self.client = chromadb.PersistentClient()
+        self.collection = self.__open_collection(COLLECTION)
+        # Overlapping windows of file contents, tied to their file by parent_id
+        self.chunks = self.__open_collection(CHUNK_COLLECTION)
+        self.chunking = settings.get_chunk_index()
+        write_buffer = settings.get_write_buffer()
+        self.max_entries = write_buffer["max_entries"]
+        self.max_age = write_buffer["max_age"]
+        self.buffer: dict[str, dict] = {}
+        self.buffered_at = 0.0
+        # Failed writes per buffered id
+        self.write_failures: dict[str, int] = {}
+        self.lock = threading.RLock()
+        # Bumped on every write so that readers can tell their results are stale
+        self.generation = 0
+        # Called with the entries and embeddings of every batch written
+        self.write_subscribers: list[Callable[[list[dict], list], None]] = []
+        self.lexical = LexicalIndex()
+        if self.__migrate_ids():
+            self.lexical.clear()
+        self.__migrate_fields()
+        self.__sync_lexical()
+        self.journal = WriteJournal()
+        self.__replay_journal()
+        self.is_dead = threading.Event()
+        self.flusher = threading.Thread(target=self.__flush_periodically, daemon=True)
+        self.flusher.start()
 
     """
     Stores embedding vector to db
@@ -25,36 +158,499 @@ class VectorDatabase:
         None
     """
 
-    def create_entry(self, file: File, summary: str):
-        id = str(uuid.uuid4())
-        self.collection.add(
-            ids=id,
-            documents=summary,
-            metadatas={
-                "path": file.path,
-                "basename": file.basename,
-                "extension": file.extension,
-            },
-        )
+    def create_entry(
+        self,
+        file: File,
+        summary: str,
+        content_hash: str | None = None,
+        contents: str | None = None,
+    ):
+        id = document_id(file.path)
+        stat = file.stat()
+        metadata = {
+            "path": file.path,
+            "basename": file.basename,
+            "extension": file.extension,
+            # Lowercased for case-insensitive filtering
+            "ext": file.extension.lower(),
+            "size_bytes": stat.st_size,
+            "mtime": stat.st_mtime,
+            "ctime": stat.st_ctime,
+        }
+        if content_hash:
+            metadata["content_hash"] = content_hash
+        entry = {"id": id, "document": summary, "metadata": metadata}
+        if self.chunking["enabled"] and contents:
+            entry["chunks"] = split_chunks(
+                contents,
+                self.chunking["words"],
+                self.chunking["overlap"],
+                self.chunking["max_chunks"],
+            )
+        with self.lock:
+            self.journal.append(entry)
+            if not self.buffer:
+                self.buffered_at = time.monotonic()
+            # A newer entry for the same file replaces the buffered one
+            self.buffer[id] = entry
+            self.generation += 1
+            if len(self.buffer) >= self.max_entries:
+                self.__try_flush()
         logging.info(f"Created entry with id {id} for file {file.path}")
 
-    def get_query_results(self, query: str, limit: int = 10):
-        res = self.collection.query(
-            query_texts=query, n_results=limit, include=["metadatas", "documents", "distances"]
+    def subscribe_writes(self, callback: Callable[[list[dict], list], None]):
+        self.write_subscribers.append(callback)
+
+    def flush(self):
+        """
+        Write all buffered entries to the collection in a single batch. If that
+        fails they are written one by one, so that a bad entry can't hold up the
+        others, and raises if any entry is still buffered afterwards.
+        """
+        with self.lock:
+            if not self.buffer:
+                return
+            entries = list(self.buffer.values())
+            error = None
+            try:
+                self.__write(entries)
+                written = entries
+            except Exception as e:
+                if len(entries) == 1:
+                    written, error = [], e
+                else:
+                    written, error = self.__write_one_by_one(entries)
+            for entry in written:
+                del self.buffer[entry["id"]]
+                self.write_failures.pop(entry["id"], None)
+            if written:
+                logging.info(f"Flushed {len(written)} entries")
+            self.journal.rewrite(list(self.buffer.values()))
+            if error is not None and self.buffer:
+                raise error
+
+    def close(self):
+        self.is_dead.set()
+        self.flusher.join()
+        self.__try_flush()
+        self.journal.close()
+        self.lexical.close()
+
+    def get_query_results(
+        self, query: str, limit: int = 10, filters: QueryFilters | None = None
+    ):
+        """
+        Rows matching the query and filters, best first. Full-text and vector
+        rankings are fused with reciprocal rank fusion, identifier queries with a
+        full-text match skip the vector search.
+        """
+        return self.get_ranked_results(query, limit, filters)[0]
+
+    def get_ranked_results(
+        self, query: str, limit: int = 10, filters: QueryFilters | None = None
+    ) -> tuple[dict[str, models.File], int]:
+        """
+        get_query_results, along with the number of candidates ranked before
+        stale rows were dropped. Fewer candidates than limit means there are no
+        more matches. Buffered entries aren't searched until the periodic flush
+        writes them, about max_age later, so queries never wait on the write lock.
+        """
+        filters = filters or QueryFilters()
+        where = filters.where()
+        candidates = None
+        if filters.folder:
+            # Chroma has no prefix operator, so narrow the search to ids instead
+            candidates = self.lexical.ids_in_folder(filters.folder)
+            if not candidates:
+                return {}, 0
+
+        rows = {}
+        # Over-fetch full-text matches since the where clause may drop some
+        lexical_ids = self.lexical.search(
+            query, limit * 4 if where else limit, filters.folder
         )
+        if lexical_ids and where:
+            rows = self.__get_rows(lexical_ids, where)
+            lexical_ids = [id for id in lexical_ids if id in rows][:limit]
+        if lexical_ids and IDENTIFIER.fullmatch(query.strip()):
+            rankings = [lexical_ids]
+        else:
+            vector_rows = self.__vector_search(query, limit, where, candidates)
+            rows.update(vector_rows)
+            rankings = [lexical_ids, list(vector_rows.keys())]
+            if self.chunking["enabled"]:
+                chunk_ids = self.__chunk_search(query, limit, candidates)
+                if chunk_ids and where:
+                    rows.update(self.__get_rows(chunk_ids, where))
+                    chunk_ids = [id for id in chunk_ids if id in rows]
+                rankings.append(chunk_ids)
 
-        return {
-            id: models.File(
-                summary=document,
-                name=metadata["basename"],
-                path=metadata["path"],
-                extension=metadata["extension"],
+        scores: dict[str, float] = {}
+        for ranking in rankings:
+            for rank, id in enumerate(ranking):
+                scores[id] = scores.get(id, 0.0) + 1 / (RRF_K + rank + 1)
+        ids = sorted(scores, key=scores.get, reverse=True)[:limit]
+
+        missing = [id for id in ids if id not in rows]
+        if missing:
+            rows.update(self.__get_rows(missing))
+        results = {
+            id: to_model(*rows[id])
+            for id in ids
+            if id in rows and not rows[id][1].get("stale")
+        }
+        return results, len(ids)
+
+    def get_metadata(self, ids: chromadb.api.types.IDs) -> dict[str, dict]:
+        self.__try_flush()
+        res = self.collection.get(ids=ids, include=["metadatas"])
+        return dict(zip(res["ids"], res["metadatas"]))
+
+    def get_ids(self) -> list[str]:
+        """Ids of every row, a snapshot that concurrent writes don't shift"""
+        self.__try_flush()
+        return self.collection.get(include=[])["ids"]
+
+    def move_entry(self, id: str, path: str):
+        """Point an existing row at the file's new location, keeping its embedding"""
+        with self.lock:
+            self.__try_flush()
+            res = self.collection.get(
+                ids=[id], include=["documents", "metadatas", "embeddings"]
+            )
+            if not res["ids"]:
+                return
+            stat = Path(path).stat()
+            metadata = {
+                **res["metadatas"][0],
+                "path": path,
+                "basename": Path(path).name,
+                "extension": Path(path).suffix,
+                "ext": Path(path).suffix.lower(),
+                "size_bytes": stat.st_size,
+                "mtime": stat.st_mtime,
+                "ctime": stat.st_ctime,
+            }
+            metadata.pop("stale", None)
+            new_id = document_id(path)
+            self.collection.upsert(
+                ids=[new_id],
+                documents=res["documents"],
+                metadatas=[metadata],
+                embeddings=res["embeddings"],
             )
+            if new_id != id:
+                self.collection.delete(ids=[id])
+            self.lexical.delete([id])
+            self.lexical.upsert(
+                [{"id": new_id, "document": res["documents"][0], "metadata": metadata}]
+            )
+            self.__move_chunks(id, new_id)
+            self.generation += 1
+
+    def __move_chunks(self, id: str, new_id: str):
+        chunks = self.chunks.get(
+            where={"parent_id": id}, include=["documents", "embeddings"]
+        )
+        if not chunks["ids"] or new_id == id:
+            return
+        self.chunks.upsert(
+            ids=[f"{new_id}:{i}" for i in range(len(chunks["ids"]))],
+            documents=chunks["documents"],
+            metadatas=[{"parent_id": new_id}] * len(chunks["ids"]),
+            embeddings=chunks["embeddings"],
+        )
+        self.chunks.delete(ids=chunks["ids"])
+
+    def update_metadata(self, metadatas: dict[str, dict]):
+        """Replace the metadata of existing rows, keyed by id"""
+        with self.lock:
+            self.__try_flush()
+            self.collection.update(
+                ids=list(metadatas.keys()), metadatas=list(metadatas.values())
+            )
+            self.generation += 1
+
+    def remove_entries(self, ids: chromadb.api.types.IDs):
+        with self.lock:
+            self.__try_flush()
+            self.collection.delete(ids)
+            self.chunks.delete(where={"parent_id": {"$in": ids}})
+            self.lexical.delete(ids)
+            self.generation += 1
+
+    def __write(self, entries: list[dict]):
+        documents = [entry["document"] for entry in entries]
+        embeddings = self.embedder.embed_documents(documents)
+        self.collection.upsert(
+            ids=[entry["id"] for entry in entries],
+            documents=documents,
+            metadatas=[entry["metadata"] for entry in entries],
+            embeddings=embeddings,
+        )
+        self.lexical.upsert(entries)
+        self.__write_chunks(entries)
+        for callback in self.write_subscribers:
+            try:
+                callback(entries, embeddings)
+            except Exception as e:
+                logging.error(f"Write subscriber failed: {e}")
+
+    def __write_one_by_one(self, entries: list[dict]) -> tuple[list[dict], Exception]:
+        """Entries written on their own, and the last error of those that weren't"""
+        written, failed, error = [], [], None
+        for entry in entries:
+            try:
+                self.__write([entry])
+                written.append(entry)
+            except Exception as e:
+                failed.append(entry)
+                error = e
+        # Only blame entries when the database otherwise works, the cause of every
+        # write failing is more likely to be, say, the embedding model
+        if written:
+            for entry in failed:
+                attempts = self.write_failures.get(entry["id"], 0) + 1
+                self.write_failures[entry["id"]] = attempts
+                if attempts >= MAX_WRITE_ATTEMPTS:
+                    self.__quarantine(entry, error)
+        return written, error
+
+    def __quarantine(self, entry: dict, error: Exception):
+        """Set aside an entry that keeps failing, so it is no longer retried"""
+        with open(QUARANTINE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**entry, "error": str(error)}) + "\n")
+        del self.buffer[entry["id"]]
+        self.write_failures.pop(entry["id"], None)
+        logging.error(
+            f"Moved entry for {entry['metadata']['path']} to {QUARANTINE_FILE} "
+            f"after {MAX_WRITE_ATTEMPTS} failed writes: {error}"
+        )
+
+    def __write_chunks(self, entries: list[dict]):
+        # Replace every chunk of the written files, their contents may have shrunk
+        self.chunks.delete(where={"parent_id": {"$in": [e["id"] for e in entries]}})
+        ids, documents, metadatas = [], [], []
+        for entry in entries:
+            for i, chunk in enumerate(entry.get("chunks", [])):
+                ids.append(f"{entry['id']}:{i}")
+                documents.append(chunk)
+                metadatas.append({"parent_id": entry["id"]})
+        if ids:
+            self.chunks.upsert(
+                ids=ids,
+                documents=documents,
+                metadatas=metadatas,
+                embeddings=self.embedder.embed_documents(documents),
+            )
+
+    def __get_rows(
+        self, ids: list[str], where: dict | None = None
+    ) -> dict[str, tuple[str, dict]]:
+        res = self.collection.get(
+            ids=ids, where=where, include=["metadatas", "documents"]
+        )
+        return dict(zip(res["ids"], zip(res["documents"], res["metadatas"])))
+
+    def __chunk_search(
+        self, query: str, limit: int, ids: list[str] | None = None
+    ) -> list[str]:
+        """Ids of the files whose chunks match the query best, best first"""
+        where = {"parent_id": {"$in": ids}} if ids is not None else None
+        res = self.chunks.query(
+            query_embeddings=[self.embedder.embed_query(query)],
+            n_results=limit * CHUNK_FANOUT,
+            where=where,
+            include=["metadatas", "distances"],
+        )
+        scores: dict[str, float] = {}
+        for metadata, distance in zip(res["metadatas"][0], res["distances"][0]):
+            if distance >= DISTANCE_THRESHOLD:
+                continue
+            # Squared L2 distance between unit vectors is 2 - 2 * cosine similarity
+            similarity = 1 - distance / 2
+            parent_id = metadata["parent_id"]
+            if self.chunking["aggregation"] == "sum":
+                scores[parent_id] = scores.get(parent_id, 0.0) + similarity
+            else:
+                scores[parent_id] = max(scores.get(parent_id, similarity), similarity)
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    def __vector_search(
+        self,
+        query: str,
+        limit: int,
+        where: dict | None = None,
+        ids: list[str] | None = None,
+    ) -> dict[str, tuple[str, dict]]:
+        res = self.collection.query(
+            query_embeddings=[self.embedder.embed_query(query)],
+            n_results=limit,
+            where=where,
+            ids=ids,
+            include=["metadatas", "documents", "distances"],
+        )
+        return {
+            id: (document, metadata)
             for document, metadata, id, distance in zip(
-                res["documents"][0], res["metadatas"][0], res["ids"][0], res["distances"][0]
+                res["documents"][0],
+                res["metadatas"][0],
+                res["ids"][0],
+                res["distances"][0],
             )
             if distance < DISTANCE_THRESHOLD
         }
 
-    def remove_entries(self, ids: chromadb.api.types.IDs):
-        self.collection.delete(ids)
+    def __get_collection(self, name: str) -> chromadb.Collection:
+        # Embeddings are passed in explicitly, so the collection needs no function
+        return self.client.get_or_create_collection(
+            name,
+            embedding_function=None,
+            metadata={"embedding_model": self.embedder.model},
+        )
+
+    def __open_collection(self, name: str) -> chromadb.Collection:
+        """Open a collection, re-embedding it if it was built with another model"""
+        collection = self.__get_collection(name)
+        model = (collection.metadata or {}).get("embedding_model", DEFAULT_MODEL)
+        if model == self.embedder.model:
+            return collection
+        total = collection.count()
+        logging.info(
+            f"Embedding model changed from {model} to {self.embedder.model}, "
+            f"re-embedding {total} entries of {name}"
+        )
+        # The new model may have a different dimension, so copy into a new collection
+        try:
+            # Left over from an interrupted rebuild
+            self.client.delete_collection(f"{name}_rebuild")
+        except chromadb.errors.NotFoundError:
+            pass
+        rebuilt = self.__get_collection(f"{name}_rebuild")
+        for offset in range(0, total, 256):
+            res = collection.get(
+                offset=offset, limit=256, include=["documents", "metadatas"]
+            )
+            rebuilt.upsert(
+                ids=res["ids"],
+                documents=res["documents"],
+                metadatas=res["metadatas"],
+                embeddings=self.embedder.embed_documents(res["documents"]),
+            )
+        self.client.delete_collection(name)
+        rebuilt.modify(name=name)
+        return rebuilt
+
+    def __migrate_ids(self) -> bool:
+        """
+        Re-key rows from before ids were derived from the path, keeping the most
+        recently modified row of each file, or the last inserted one on a tie. Runs
+        once per collection, returns whether any row changed.
+        """
+        metadata = self.collection.metadata or {}
+        if metadata.get("stable_ids"):
+            return False
+        stable, legacy_ids = set(), []
+        # Newest legacy row of each file, keyed by its stable id
+        latest: dict[str, tuple[str, dict]] = {}
+        for offset in range(0, self.collection.count(), 256):
+            res = self.collection.get(offset=offset, limit=256, include=["metadatas"])
+            for id, row in zip(res["ids"], res["metadatas"]):
+                new_id = document_id(row["path"])
+                if id == new_id:
+                    stable.add(id)
+                    continue
+                legacy_ids.append(id)
+                newest = latest.get(new_id)
+                # get() pages in insertion order, so on a tie the later row wins
+                if newest is None or row.get("mtime", 0) >= newest[1].get("mtime", 0):
+                    latest[new_id] = (id, row)
+        for new_id, (id, _) in latest.items():
+            if new_id in stable:
+                continue
+            res = self.collection.get(
+                ids=[id], include=["documents", "metadatas", "embeddings"]
+            )
+            self.collection.upsert(
+                ids=[new_id],
+                documents=res["documents"],
+                metadatas=res["metadatas"],
+                embeddings=res["embeddings"],
+            )
+        if legacy_ids:
+            self.collection.delete(ids=legacy_ids)
+            logging.info(f"Re-keyed {len(legacy_ids)} rows to stable ids")
+        self.collection.modify(metadata={**metadata, "stable_ids": True})
+        return bool(legacy_ids)
+
+    def __migrate_fields(self):
+        """
+        Backfill the lowercased extension and file stats of rows from before they
+        were stored, marking rows whose file is gone as stale
+        """
+        metadata = self.collection.metadata or {}
+        if metadata.get("file_fields"):
+            return
+        for offset in range(0, self.collection.count(), 256):
+            res = self.collection.get(offset=offset, limit=256, include=["metadatas"])
+            updates = {}
+            for id, row in zip(res["ids"], res["metadatas"]):
+                if all(key in row for key in ("ext", "size_bytes", "mtime", "ctime")):
+                    continue
+                row = {**row, "ext": row["extension"].lower()}
+                try:
+                    stat = Path(row["path"]).stat()
+                except OSError:
+                    row["stale"] = True
+                else:
+                    row["size_bytes"] = stat.st_size
+                    row["mtime"] = stat.st_mtime
+                    row["ctime"] = stat.st_ctime
+                updates[id] = row
+            if updates:
+                self.collection.update(
+                    ids=list(updates.keys()), metadatas=list(updates.values())
+                )
+        self.collection.modify(metadata={**metadata, "file_fields": True})
+
+    def __sync_lexical(self):
+        """Rebuild the full-text index if it has drifted from the collection"""
+        total = self.collection.count()
+        if self.lexical.count() == total:
+            return
+        logging.info(f"Rebuilding full-text index for {total} entries")
+        self.lexical.clear()
+        for offset in range(0, total, 256):
+            res = self.collection.get(
+                offset=offset, limit=256, include=["documents", "metadatas"]
+            )
+            self.lexical.upsert(
+                [
+                    {"id": id, "document": document, "metadata": metadata}
+                    for id, document, metadata in zip(
+                        res["ids"], res["documents"], res["metadatas"]
+                    )
+                ]
+            )
+
+    def __replay_journal(self):
+        entries = {entry["id"]: entry for entry in self.journal.read()}
+        if entries:
+            logging.info(f"Replaying {len(entries)} entries from the write journal")
+            self.buffer.update(entries)
+            self.buffered_at = time.monotonic()
+            # Entries that fail stay buffered for the periodic flush to retry
+            self.__try_flush()
+
+    def __flush_periodically(self):
+        while not self.is_dead.wait(self.max_age / 2):
+            with self.lock:
+                if self.buffer and time.monotonic() - self.buffered_at >= self.max_age:
+                    self.__try_flush()
+
+    def __try_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # Entries stay buffered and journaled, the next flush retries them
+            logging.error(f"Failed to flush entries: {e}")
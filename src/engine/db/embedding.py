@@ -0,0 +1,87 @@
+import logging
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils.embedding_functions import (
+    ONNXMiniLM_L6_V2,
+    SentenceTransformerEmbeddingFunction,
+)
+
+# Chroma's built-in model, which collections from before this module used
+DEFAULT_MODEL = ONNXMiniLM_L6_V2.MODEL_NAME
+
+
+class _ONNXMiniLM(ONNXMiniLM_L6_V2):
+    """Chroma's default model with a configurable number of inference threads"""
+
+    def __init__(self, threads: int):
+        super().__init__()
+        self.threads = threads
+
+    @cached_property
+    def model(self):
+        options = self.ort.SessionOptions()
+        options.log_severity_level = 3
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        return self.ort.InferenceSession(
+            str(self.DOWNLOAD_PATH / self.EXTRACTED_FOLDER_NAME / "model.onnx"),
+            # CoreML is slower than the CPU provider for this model
+            providers=[
+                provider
+                for provider in self.ort.get_available_providers()
+                if provider != "CoreMLExecutionProvider"
+            ],
+            sess_options=options,
+        )
+
+
+def _load(model: str, threads: int) -> EmbeddingFunction:
+    if model == DEFAULT_MODEL:
+        return _ONNXMiniLM(threads)
+    # Any other model name is looked up on the sentence-transformers hub
+    return SentenceTransformerEmbeddingFunction(model_name=model, device="cpu")
+
+
+class EmbeddingEngine:
+    """
+    Embeds documents and queries for the vector database. Embeddings are
+    computed here rather than by Chroma so that the model is configurable, can
+    be loaded ahead of the first query, and repeated queries skip inference.
+    """
+
+    def __init__(self, model: str, batch_size: int, threads: int, cache_size: int):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.lock = threading.Lock()
+        self.function = _load(model, threads)
+
+    def warm_up(self):
+        """Load the model and run it once, so the first query doesn't pay for it"""
+        self.embed_query("")
+        logging.info(f"Loaded embedding model {self.model}")
+
+    def embed_documents(self, documents: list[str]) -> list[np.ndarray]:
+        embeddings = []
+        for start in range(0, len(documents), self.batch_size):
+            embeddings.extend(self.function(documents[start : start + self.batch_size]))
+        return embeddings
+
+    def embed_query(self, query: str) -> np.ndarray:
+        with self.lock:
+            embedding = self.cache.get(query)
+            if embedding is not None:
+                self.cache.move_to_end(query)
+                return embedding
+        embedding = self.function([query])[0]
+        with self.lock:
+            self.cache[query] = embedding
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return embedding
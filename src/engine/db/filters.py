@@ -0,0 +1,61 @@
+from pathlib import Path
+from typing import Optional
+
+
+class QueryFilters:
+    """
+    Structured constraints on query results, pushed down into the vector search.
+    Sizes are in bytes and modification times are unix timestamps, all bounds
+    are inclusive.
+    """
+
+    def __init__(
+        self,
+        extension: Optional[str] = None,
+        folder: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        modified_after: Optional[float] = None,
+        modified_before: Optional[float] = None,
+    ):
+        if extension:
+            extension = "." + extension.lstrip(".")
+        if folder:
+            folder = str(Path(folder).expanduser().resolve())
+        self.extension = extension or None
+        self.folder = folder or None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+
+    def key(self) -> tuple:
+        """Hashable form of the filters, for caching results"""
+        return (
+            self.extension and self.extension.lower(),
+            self.folder,
+            self.min_size,
+            self.max_size,
+            self.modified_after,
+            self.modified_before,
+        )
+
+    def where(self) -> dict | None:
+        """Chroma where clause for every filter except the folder"""
+        clauses = []
+        if self.extension:
+            clauses.append({"ext": self.extension.lower()})
+        if self.min_size is not None:
+            clauses.append({"size_bytes": {"$gte": self.min_size}})
+        if self.max_size is not None:
+            clauses.append({"size_bytes": {"$lte": self.max_size}})
+        if self.modified_after is not None:
+            clauses.append({"mtime": {"$gte": self.modified_after}})
+        if self.modified_before is not None:
+            clauses.append({"mtime": {"$lte": self.modified_before}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def __repr__(self):
+        return f"QueryFilters{self.key()}"
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from settings import BASE_DIR
+
+LEXICAL_FILE = BASE_DIR / "munchkin_lexical.db"
+# Relative weights of basename, path and summary matches
+BM25_WEIGHTS = (10.0, 2.0, 1.0)
+FOLDER_MATCH = "(entries.folder = ? OR entries.folder LIKE ? ESCAPE '\\')"
+
+
+def _folder_params(folder: str) -> tuple[str, str]:
+    """Parameters of FOLDER_MATCH, the folder itself and a pattern for subfolders"""
+    folder = folder.rstrip(os.sep) or os.sep
+    prefix = folder if folder.endswith(os.sep) else folder + os.sep
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return folder, escaped + "%"
+
+
+def match_expression(query: str) -> str | None:
+    """
+    FTS5 expression requiring every whitespace separated term of the query.
+    Each term is quoted so punctuation inside identifiers like "hw1_linked_lists"
+    makes it a phrase instead of a syntax error.
+    """
+    terms = [term.replace('"', "") for term in query.split()]
+    terms = [f'"{term}"' for term in terms if term]
+    return " ".join(terms) or None
+
+
+class LexicalIndex:
+    """
+    Full-text index over the basename, path and summary of every row in the
+    vector collection, for exact filename and identifier lookups. Rows are keyed
+    by the same document ids as the collection.
+    """
+
+    def __init__(self, path: Path = LEXICAL_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    rowid INTEGER PRIMARY KEY,
+                    id TEXT UNIQUE NOT NULL,
+                    path TEXT NOT NULL,
+                    folder TEXT NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_path ON entries (path)"
+            )
+            self.conn.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts
+                USING fts5(basename, path, summary)
+                """
+            )
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def upsert(self, entries: list[dict]):
+        """Add or replace entries, each with an id, document and metadata"""
+        with self.lock, self.conn:
+            for entry in entries:
+                self.__delete("id", entry["id"])
+                metadata = entry["metadata"]
+                cursor = self.conn.execute(
+                    "INSERT INTO entries (id, path, folder) VALUES (?, ?, ?)",
+                    (entry["id"], metadata["path"], os.path.dirname(metadata["path"])),
+                )
+                self.conn.execute(
+                    """
+                    INSERT INTO entries_fts (rowid, basename, path, summary)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (
+                        cursor.lastrowid,
+                        metadata["basename"],
+                        metadata["path"],
+                        entry["document"],
+                    ),
+                )
+
+    def delete(self, ids: list[str]):
+        with self.lock, self.conn:
+            for id in ids:
+                self.__delete("id", id)
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("DELETE FROM entries_fts")
+
+    def search(self, query: str, limit: int, folder: str | None = None) -> list[str]:
+        """Ids of the best matching entries, best first"""
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        folder_clause, folder_params = "", ()
+        if folder:
+            folder_clause, folder_params = f"AND {FOLDER_MATCH}", _folder_params(folder)
+        with self.lock:
+            try:
+                rows = self.conn.execute(
+                    f"""
+                    SELECT entries.id FROM entries_fts
+                    JOIN entries ON entries.rowid = entries_fts.rowid
+                    WHERE entries_fts MATCH ? {folder_clause}
+                    ORDER BY bm25(entries_fts, ?, ?, ?)
+                    LIMIT ?
+                    """,
+                    (expression, *folder_params, *BM25_WEIGHTS, limit),
+                ).fetchall()
+            except sqlite3.OperationalError:
+                # Queries made up only of FTS syntax, like a lone "*"
+                return []
+        return [row[0] for row in rows]
+
+    def ids_in_folder(self, folder: str) -> list[str]:
+        """Ids of the entries in the folder or any of its subfolders"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id FROM entries WHERE {FOLDER_MATCH}", _folder_params(folder)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __delete(self, column: str, value: str):
+        rowids = self.conn.execute(
+            f"SELECT rowid FROM entries WHERE {column} = ?", (value,)
+        ).fetchall()
+        for (rowid,) in rowids:
+            self.conn.execute("DELETE FROM entries_fts WHERE rowid = ?", (rowid,))
+            self.conn.execute("DELETE FROM entries WHERE rowid = ?", (rowid,))
@@ -0,0 +1,152 @@
+import logging
+import multiprocessing
+import queue
+from multiprocessing.connection import Connection
+from typing import Optional
+
+from engine.preprocessor import Preprocessor
+from engine.watcher import File
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class ExtractionError(Exception):
+    """
+    Extraction failed in a worker process.
+    kind is one of "timeout", "crash", "memory" or "error".
+    """
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(f"{kind}: {message}")
+        self.kind = kind
+        self.message = message
+
+
+def _worker_main(conn: Connection, token_threshold: Optional[int], memory_mb: int):
+    if resource is not None and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    preprocessor = Preprocessor(token_threshold)
+    while True:
+        try:
+            file = conn.recv()
+        except EOFError:
+            return
+        if file is None:
+            return
+        try:
+            conn.send(("ok", preprocessor.preprocess(file)))
+        except MemoryError:
+            conn.send(("memory", f"Exceeded {memory_mb} MB extracting {file.path}"))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx, token_threshold: Optional[int], memory_mb: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, token_threshold, memory_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def run(self, file: File, timeout: float) -> str:
+        self.jobs += 1
+        self.conn.send(file)
+        if not self.conn.poll(timeout):
+            raise ExtractionError("timeout", f"No result after {timeout}s")
+        try:
+            kind, payload = self.conn.recv()
+        except EOFError:
+            self.process.join(1)
+            raise ExtractionError(
+                "crash", f"Worker exited with code {self.process.exitcode}"
+            )
+        if kind != "ok":
+            raise ExtractionError(kind, payload)
+        return payload
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """
+    Runs Preprocessor in separate processes so that parsing can use every core
+    and a hanging or crashing parser only takes down its worker.
+    Workers are killed when a file exceeds the timeout, and recycled after
+    max_jobs files to bound leaks in the parsing libraries.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        token_threshold: Optional[int] = None,
+        timeout: float = 60,
+        memory_mb: int = 1024,
+        max_jobs: int = 100,
+    ):
+        self.workers = max(1, workers)
+        self.token_threshold = token_threshold
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.max_jobs = max_jobs
+        # Forking a process with running threads is unsafe
+        self.ctx = multiprocessing.get_context("spawn")
+        self.idle: queue.Queue[_Worker] = queue.Queue()
+
+    def start(self):
+        for _ in range(self.workers):
+            self.idle.put(self.__spawn())
+
+    def close(self):
+        for _ in range(self.workers):
+            self.idle.get().close()
+
+    def extract(self, file: File) -> str:
+        """Extract the text of a file, raising ExtractionError on failure"""
+        worker = self.idle.get()
+        try:
+            result = worker.run(file, self.timeout)
+        except ExtractionError as e:
+            if e.kind == "error":
+                # The parser raised, the worker itself is still healthy
+                self.idle.put(worker)
+                raise
+            self.__replace(worker, f"{file.path}: {e}")
+            raise
+        except OSError as e:
+            self.__replace(worker, f"{file.path}: {e}")
+            raise ExtractionError("crash", str(e)) from e
+        if worker.jobs >= self.max_jobs:
+            worker.close()
+            worker = self.__spawn()
+        self.idle.put(worker)
+        return result
+
+    def __replace(self, worker: _Worker, reason: str):
+        logging.error(f"Restarting extraction worker after failure on {reason}")
+        worker.kill()
+        self.idle.put(self.__spawn())
+
+    def __spawn(self) -> _Worker:
+        return _Worker(self.ctx, self.token_threshold, self.memory_mb)
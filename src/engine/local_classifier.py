@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from engine.db.database import VectorDatabase
+from settings import settings
+
+# Retrain from the whole index at most this often, and only after it changed
+RETRAIN_INTERVAL = 600.0
+
+
+def _folder_key(path: str) -> str:
+    return os.path.normcase(os.path.normpath(path))
+
+
+def _normalize(embedding) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return embedding / (np.linalg.norm(embedding) or 1.0)
+
+
+class CentroidClassifier:
+    """
+    Nearest-centroid classifier over the summary embeddings of the files already
+    filed into each destination folder. New entries are added as they are
+    written, and the centroids are periodically rebuilt from the index so that
+    deleted, moved and rewritten files stop counting.
+    """
+
+    def __init__(self, db: VectorDatabase):
+        self.db = db
+        self.sums: dict[str, np.ndarray] = {}
+        self.counts: dict[str, int] = {}
+        # Ids already in the sums, an id is derived from the path so it always
+        # counts toward the same folder
+        self.counted: set[str] = set()
+        self.lock = threading.Lock()
+        self.trained_generation: int | None = None
+        self.trained_at = -RETRAIN_INTERVAL
+        self.training = False
+        db.subscribe_writes(self.__add)
+
+    def predict(
+        self, embedding: np.ndarray, folder_paths: dict[str, str]
+    ) -> str | None:
+        """The folder whose centroid clearly beats the runner-up's, if any"""
+        config = settings.get_local_classifier()
+        self.__retrain_if_stale()
+        folders, centroids = [], []
+        with self.lock:
+            for folder in folder_paths:
+                key = _folder_key(folder)
+                if self.counts.get(key, 0) >= config["min_examples"]:
+                    folders.append(folder)
+                    centroids.append(_normalize(self.sums[key]))
+        if not folders:
+            return None
+        similarities = np.array(centroids) @ _normalize(embedding)
+        ranked = np.argsort(similarities)[::-1]
+        best = similarities[ranked[0]]
+        runner_up = similarities[ranked[1]] if len(ranked) > 1 else 0.0
+        if best < config["min_similarity"] or best - runner_up < config["margin"]:
+            return None
+        return folders[ranked[0]]
+
+    def train(self):
+        """Rebuild every centroid from the embeddings stored in the index"""
+        generation = self.db.generation
+        self.db.flush()
+        sums: dict[str, np.ndarray] = {}
+        counts: dict[str, int] = {}
+        counted: set[str] = set()
+        total = self.db.collection.count()
+        for offset in range(0, total, 256):
+            res = self.db.collection.get(
+                offset=offset, limit=256, include=["embeddings", "metadatas"]
+            )
+            for id, embedding, metadata in zip(
+                res["ids"], res["embeddings"], res["metadatas"]
+            ):
+                if metadata.get("stale"):
+                    continue
+                counted.add(id)
+                key = _folder_key(os.path.dirname(metadata["path"]))
+                embedding = _normalize(embedding)
+                sums[key] = sums[key] + embedding if key in sums else embedding
+                counts[key] = counts.get(key, 0) + 1
+        with self.lock:
+            self.sums, self.counts, self.counted = sums, counts, counted
+            self.trained_generation = generation
+        logging.info(f"Trained local classifier on {total} entries")
+
+    def __retrain_if_stale(self):
+        with self.lock:
+            if self.training:
+                return
+            if (
+                self.trained_generation == self.db.generation
+                or time.monotonic() - self.trained_at < RETRAIN_INTERVAL
+            ):
+                return
+            self.training = True
+            self.trained_at = time.monotonic()
+        threading.Thread(target=self.__train_in_background, daemon=True).start()
+
+    def __train_in_background(self):
+        try:
+            self.train()
+        except Exception as e:
+            logging.error(f"Failed to train local classifier: {e}")
+        finally:
+            with self.lock:
+                self.training = False
+
+    def __add(self, entries: list[dict], embeddings: list[np.ndarray]):
+        """
+        Count newly written files. A rewritten file keeps its old embedding until
+        the next retrain rather than being counted twice.
+        """
+        with self.lock:
+            for entry, embedding in zip(entries, embeddings):
+                if entry["id"] in self.counted:
+                    continue
+                self.counted.add(entry["id"])
+                key = _folder_key(os.path.dirname(entry["metadata"]["path"]))
+                embedding = _normalize(embedding)
+                self.sums[key] = (
+                    self.sums[key] + embedding if key in self.sums else embedding
+                )
+                self.counts[key] = self.counts.get(key, 0) + 1
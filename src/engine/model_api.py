@@ -1,23 +1,247 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 from settings import settings
 
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Failures to connect, or responses cut short or garbled on the way
+RETRYABLE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without contacting the API while it is considered down"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for `cooldown`
+    seconds. After that a single trial call is let through, closing the circuit
+    again if it succeeds.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_running:
+                raise CircuitOpenError(
+                    "API unavailable, not retrying until cooldown ends"
+                )
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self):
+        """End a trial call without a verdict, like when it was cancelled"""
+        with self.lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logging.warning(f"Opening circuit after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+# Sessions and breakers are shared by every ModelAPI talking to the same endpoint
+_sessions: dict[str, requests.Session] = {}
+_breakers: dict[str, CircuitBreaker] = {}
+_shared_lock = threading.Lock()
+
+
+def _get_session(endpoint_base: str, pool_size: int) -> requests.Session:
+    with _shared_lock:
+        if endpoint_base not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[endpoint_base] = session
+        return _sessions[endpoint_base]
+
+
+def _get_breaker(endpoint_base: str, threshold: int, cooldown: float) -> CircuitBreaker:
+    with _shared_lock:
+        if endpoint_base not in _breakers:
+            _breakers[endpoint_base] = CircuitBreaker(threshold, cooldown)
+        return _breakers[endpoint_base]
+
+
+class TokenBucket:
+    """Client-side rate limiter allowing `rate` requests per second with bursts"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.updated_at
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _AsyncTransport:
+    def __init__(self, http: dict):
+        self.client = httpx.AsyncClient(
+            headers={"Content-Type": "application/json"},
+            timeout=httpx.Timeout(
+                http["read_timeout"], connect=http["connect_timeout"]
+            ),
+            limits=httpx.Limits(max_connections=http["max_in_flight"]),
+        )
+        self.semaphore = asyncio.Semaphore(http["max_in_flight"])
+        self.bucket = TokenBucket(http["rate_limit_per_minute"] / 60, http["burst"])
 
-class ModelAPI:
-    def __init__(self, model_name: str, temperature: float = 0.0):
+
+# Async clients are bound to the event loop they were created in
+_async_transports: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[str, _AsyncTransport]
+] = weakref.WeakKeyDictionary()
+
+
+def _get_async_transport(endpoint_base: str, http: dict) -> _AsyncTransport:
+    loop = asyncio.get_running_loop()
+    with _shared_lock:
+        transports = _async_transports.setdefault(loop, {})
+        if endpoint_base not in transports:
+            transports[endpoint_base] = _AsyncTransport(http)
+        return transports[endpoint_base]
+
+
+def _retry_after(response: requests.Response | httpx.Response) -> float | None:
+    """Seconds to wait according to a Retry-After header, if there is one"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(
+            0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelBackend(ABC):
+    """A text generation model, see engine.backends for the implementations"""
+
+    @abstractmethod
+    def call(self, system_prompt: str) -> str: ...
+
+    @abstractmethod
+    async def acall(self, system_prompt: str) -> str: ...
+
+
+class ModelAPI(ModelBackend):
+    """Gemini over HTTP"""
+
+    def __init__(
+        self,
+        model_name: str,
+        temperature: float = 0.0,
+        response_mime_type: str | None = None,
+        endpoint_base: str | None = None,
+    ):
         self.model_name = model_name  # e.g., "gemini-2.0-flash"
         self.temperature = temperature
+        self.response_mime_type = response_mime_type  # e.g., "application/json"
         self.api_key = settings.get_gemini_api_key()
-        self.endpoint_base = "https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
+        self.http = settings.get_model_http()
+        self.endpoint_base = endpoint_base or self.http["endpoint"]
+        self.session = _get_session(self.endpoint_base, self.http["pool_size"])
+        self.breaker = _get_breaker(
+            self.endpoint_base,
+            self.http["breaker_threshold"],
+            self.http["breaker_cooldown"],
+        )
 
     def call(self, system_prompt: str) -> str:
-        url = (
+        response = self.__post(self._url(), self._body(system_prompt))
+        return self._parse(response)
+
+    async def acall(self, system_prompt: str) -> str:
+        """
+        Async counterpart of call. In-flight requests are capped by a semaphore and
+        paced by a token bucket, both shared per endpoint within the event loop.
+        """
+        transport = _get_async_transport(self.endpoint_base, self.http)
+        url, body = self._url(), self._body(system_prompt)
+        max_retries = self.http["max_retries"]
+        for attempt in range(max_retries + 1):
+            self.breaker.before_call()
+            try:
+                await transport.bucket.acquire()
+                async with transport.semaphore:
+                    response = await transport.client.post(url, json=body)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if attempt == max_retries:
+                    raise RuntimeError(f"API call failed: {e}") from e
+                logging.warning(f"API call failed, retrying: {e}")
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except Exception:
+                # Not retried, but it must still end a half-open trial
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # Cancelled, which says nothing about the API
+                self.breaker.release_trial()
+                raise
+            if not self.__should_retry(response, attempt, max_retries):
+                return self._parse(response)
+            await asyncio.sleep(self._backoff(attempt, response))
+
+    def _url(self) -> str:
+        return (
             self.endpoint_base.format(model_name=self.model_name)
             + f"?key={self.api_key}"
         )
-        headers = {
-            "Content-Type": "application/json",
-        }
+
+    def _body(self, system_prompt: str) -> dict:
         body = {
             "contents": [{"role": "user", "parts": [{"text": system_prompt}]}],
             "generationConfig": {
@@ -26,7 +250,11 @@ class ModelAPI:
                 "topP": 0.95,
             },
         }
-        response = requests.post(url, headers=headers, json=body)
+        if self.response_mime_type:
+            body["generationConfig"]["responseMimeType"] = self.response_mime_type
+        return body
+
+    def _parse(self, response: requests.Response | httpx.Response) -> str:
         if response.status_code != 200:
             raise RuntimeError(f"API call failed: {response.text}")
 
@@ -36,3 +264,55 @@ class ModelAPI:
             return text_response
         except (KeyError, IndexError) as e:
             raise ValueError(f"Unexpected API response format: {result}") from e
+
+    def _backoff(
+        self, attempt: int, response: requests.Response | httpx.Response | None = None
+    ) -> float:
+        """Seconds to wait before the next attempt, honouring Retry-After"""
+        delay = _retry_after(response) if response is not None else None
+        if delay is None:
+            cap = min(self.http["backoff_max"], self.http["backoff_base"] * 2**attempt)
+            delay = random.uniform(0, cap)
+        return min(delay, self.http["backoff_max"])
+
+    def __should_retry(
+        self,
+        response: requests.Response | httpx.Response,
+        attempt: int,
+        max_retries: int,
+    ) -> bool:
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        if attempt == max_retries:
+            return False
+        logging.warning(f"API call returned {response.status_code}, retrying")
+        return True
+
+    def __post(self, url: str, body: dict) -> requests.Response:
+        """POST, retrying transient failures with jittered exponential backoff"""
+        timeout = (self.http["connect_timeout"], self.http["read_timeout"])
+        max_retries = self.http["max_retries"]
+        for attempt in range(max_retries + 1):
+            self.breaker.before_call()
+            try:
+                response = self.session.post(url, json=body, timeout=timeout)
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                if attempt == max_retries:
+                    raise RuntimeError(f"API call failed: {e}") from e
+                logging.warning(f"API call failed, retrying: {e}")
+                time.sleep(self._backoff(attempt))
+                continue
+            except Exception:
+                # Not retried, but it must still end a half-open trial
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # Interrupted, which says nothing about the API
+                self.breaker.release_trial()
+                raise
+            if not self.__should_retry(response, attempt, max_retries):
+                return response
+            time.sleep(self._backoff(attempt, response))
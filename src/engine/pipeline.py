@@ -0,0 +1,222 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable
+
+from engine.extraction import ExtractionPool
+from engine.saveprocessor import Job, SaveProcessor
+from settings import settings
+
+POLL_INTERVAL = 0.5
+# Number of recent files that throughput and latency percentiles are taken over
+STATS_WINDOW = 1000
+
+
+class PipelineStats:
+    """End-to-end throughput and latency of the files that made it through"""
+
+    def __init__(self):
+        self.processed = 0
+        # (finished_at, latency) of the most recent files
+        self.recent: deque[tuple[float, float]] = deque(maxlen=STATS_WINDOW)
+        self.lock = threading.Lock()
+
+    def record(self, job: Job):
+        now = time.monotonic()
+        with self.lock:
+            self.processed += 1
+            self.recent.append((now, now - job.submitted_at))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            processed, recent = self.processed, list(self.recent)
+        stats = {"processed": processed, "files_per_sec": 0.0}
+        if len(recent) > 1:
+            elapsed = recent[-1][0] - recent[0][0]
+            if elapsed > 0:
+                stats["files_per_sec"] = (len(recent) - 1) / elapsed
+        latencies = sorted(latency for _, latency in recent)
+        for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            stats[f"latency_{name}"] = (
+                latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+                if latencies
+                else None
+            )
+        return stats
+
+
+class Stage:
+    """
+    A bounded queue drained by a pool of worker threads.
+    Results are handed to the next stage, blocking while its queue is full.
+    With a batch_size above 1, fn takes a list of up to batch_size jobs, collected
+    for at most batch_wait seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Job], Job | None] | Callable[[list[Job]], list[Job]],
+        workers: int,
+        maxsize: int,
+        is_dead: threading.Event,
+        batch_size: int = 1,
+        batch_wait: float = 0.0,
+    ):
+        self.name = name
+        self.fn = fn
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        # Workers take turns filling batches so that each one fills up
+        self.batch_lock = threading.Lock()
+        self.queue: queue.Queue[Job] = queue.Queue(maxsize)
+        self.is_dead = is_dead
+        self.next: Stage | None = None
+        self.threads = [
+            threading.Thread(target=self.__run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def put(self, job: Job) -> bool:
+        """Enqueue a job, blocking while the stage is saturated"""
+        while not self.is_dead.is_set():
+            try:
+                self.queue.put(job, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __run(self):
+        while not self.is_dead.is_set():
+            try:
+                batch = self.__next_batch()
+            except queue.Empty:
+                continue
+            try:
+                if self.batch_size > 1:
+                    jobs = self.fn(batch)
+                else:
+                    jobs = [job] if (job := self.fn(batch[0])) is not None else []
+            except Exception as e:
+                paths = ", ".join(str(job.file_path) for job in batch)
+                logging.error(f"[{self.name}] {paths}: {e}")
+                continue
+            if self.next is not None:
+                for job in jobs:
+                    self.next.put(job)
+
+    def __next_batch(self) -> list[Job]:
+        if self.batch_size == 1:
+            return [self.queue.get(timeout=POLL_INTERVAL)]
+        with self.batch_lock:
+            batch = [self.queue.get(timeout=POLL_INTERVAL)]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            return batch
+
+
+class Pipeline:
+    """
+    Runs the save stages concurrently: extract -> summarize -> classify -> store.
+    Extraction is CPU bound and runs in an ExtractionPool, the remaining stages
+    mostly wait on the network or the database and run on threads.
+    """
+
+    def __init__(self, saveprocessor: SaveProcessor):
+        self.saveprocessor = saveprocessor
+        self.is_dead = threading.Event()
+        self.stats = PipelineStats()
+        workers = settings.get_pipeline_workers()
+        maxsize = settings.get_pipeline_queue_size()
+        limits = settings.get_extraction_limits()
+        self.extraction_pool = ExtractionPool(
+            workers["extract"],
+            saveprocessor.preprocessor.token_threshold,
+            timeout=limits["timeout"],
+            memory_mb=limits["memory_mb"],
+            max_jobs=limits["max_jobs"],
+        )
+        batching = settings.get_llm_batching()
+        batch_size, batch_wait = batching["size"], batching["wait_ms"] / 1000
+        if batch_size > 1:
+            summarize, classify = (
+                saveprocessor.summarize_batch,
+                saveprocessor.classify_batch,
+            )
+        else:
+            summarize, classify = saveprocessor.summarize, saveprocessor.classify
+        self.stages = [
+            Stage("extract", self.__extract, workers["extract"], maxsize, self.is_dead),
+            Stage(
+                "summarize",
+                summarize,
+                workers["summarize"],
+                maxsize,
+                self.is_dead,
+                batch_size,
+                batch_wait,
+            ),
+            Stage(
+                "classify",
+                classify,
+                workers["classify"],
+                maxsize,
+                self.is_dead,
+                batch_size,
+                batch_wait,
+            ),
+            Stage("store", self.__store, workers["store"], maxsize, self.is_dead),
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next = next_stage
+
+    def start(self):
+        self.extraction_pool.start()
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, file_path: Path) -> bool:
+        """Queue a file for processing. Blocks while the pipeline is saturated."""
+        return self.stages[0].put(Job(file_path))
+
+    def stop(self):
+        """Stop all workers, dropping files that have not been processed yet"""
+        self.is_dead.set()
+        for stage in self.stages:
+            stage.join()
+            dropped = stage.queue.qsize()
+            if dropped:
+                logging.warning(f"[{stage.name}] Dropped {dropped} queued files")
+        self.extraction_pool.close()
+
+    def __extract(self, job: Job) -> Job:
+        logging.info(f"Handle file: {job.file_path}")
+        job = self.saveprocessor.read(job)
+        return self.saveprocessor.extract(job, self.extraction_pool.extract)
+
+    def __store(self, job: Job) -> Job:
+        # The row is keyed by the destination path, so only write it once the
+        # file is actually there
+        job = self.saveprocessor.move(job)
+        job = self.saveprocessor.store(job)
+        self.stats.record(job)
+        return job
@@ -1,71 +1,106 @@
+import codecs
 import logging
-from io import BytesIO
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 import fitz  # PyMuPDF for PDF extraction
 from docx import Document
+from docx.text.paragraph import Paragraph
 
 from engine.watcher import File
 from utils import SUPPORTED_TEXT_EXTENSIONS
 
 
 class Preprocessor:
+    """
+    Extracts and normalizes the text of a file.
+    Text is pulled page by page (or paragraph, or chunk) and extraction stops as
+    soon as token_threshold characters of normalized text have been collected.
+    """
+
+    TEXT_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, token_threshold: Optional[int] = None):
         self.token_threshold = token_threshold
 
     def preprocess(self, file: File) -> str:
-        content = self._read_content(file)
-        content = self._apply_preprocessing(content)
-        return content
+        try:
+            return self._apply_preprocessing(self._read_content(file))
+        except UnicodeDecodeError:
+            logging.error(
+                f"[Warning] Failed to decode '{file.basename}' as UTF-8. Returning empty string."
+            )
+            return ""
 
-    def _read_content(self, file: File) -> str:
+    def _read_content(self, file: File) -> Iterator[str]:
         if not file.extension:
             raise ValueError("Cannot determine file type without extension.")
 
         ext = file.extension.lower()
 
         if ext == ".pdf":
-            return self._extract_text_from_pdf_bytes(file.content)
+            return self._extract_text_from_pdf(file)
 
         if ext == ".docx":
-            return self._extract_text_from_docx_bytes(file.content)
+            return self._extract_text_from_docx(file)
 
         if ext in SUPPORTED_TEXT_EXTENSIONS:
-            try:
-                return file.content.decode("utf-8")
-            except UnicodeDecodeError:
-                logging.error(
-                    f"[Warning] Failed to decode '{file.basename}' as UTF-8. Returning empty string."
-                )
-                return ""
+            return self._read_text(file)
 
         raise ValueError(f"Unsupported file extension: {file.extension}")
 
-    def _extract_text_from_pdf_bytes(self, content: bytes) -> str:
+    def _read_text(self, file: File) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for chunk in file.iter_chunks(self.TEXT_CHUNK_SIZE):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+    def _extract_text_from_pdf(self, file: File) -> Iterator[str]:
         try:
-            doc = fitz.open(stream=BytesIO(content), filetype="pdf")
-            text = "\n".join(page.get_text() for page in doc)
-            doc.close()
-            return text
+            # Opening by path lets PyMuPDF load pages on demand
+            with fitz.open(file.source_path, filetype="pdf") as doc:
+                for page in doc:
+                    yield page.get_text()
+                    yield "\n"
         except Exception as e:
             logging.error(f"[Warning] Failed to extract text from PDF: {str(e)}")
-            return ""
 
-    def _extract_text_from_docx_bytes(self, content: bytes) -> str:
+    def _extract_text_from_docx(self, file: File) -> Iterator[str]:
         try:
-            doc = Document(BytesIO(content))
-            text = "\n".join(para.text for para in doc.paragraphs)
-            return text
+            # python-docx loads every part of the package, only the text is streamed
+            with file.open() as f:
+                doc = Document(f)
+            for block in doc.iter_inner_content():
+                if isinstance(block, Paragraph):
+                    yield block.text
+                    yield "\n"
         except Exception as e:
             logging.error(f"[Warning] Failed to extract text from DOCX: {str(e)}")
-            return ""
 
-    def _apply_preprocessing(self, content: str) -> str:
-        content = content.strip()
-        content = " ".join(content.split())  # Normalize whitespace
-        if self.token_threshold:
-            content = self._truncate_content(content)
-        return content
+    def _apply_preprocessing(self, fragments: Iterable[str]) -> str:
+        """
+        Normalize whitespace in a single pass over the fragments, equivalent to
+        " ".join(text.split()) over their concatenation, stopping once the
+        budget is met.
+        """
+        parts: list[str] = []
+        length = 0
+        pending_space = False
+        for fragment in fragments:
+            words = fragment.split()
+            if not words:
+                pending_space = pending_space or bool(fragment)
+                continue
+            pending_space = pending_space or fragment[0].isspace()
+            for i, word in enumerate(words):
+                # Words split across fragment boundaries are glued back together
+                if length and (i > 0 or pending_space):
+                    word = " " + word
+                parts.append(word)
+                length += len(word)
+                if self.token_threshold and length >= self.token_threshold:
+                    return self._truncate_content("".join(parts))
+            pending_space = fragment[-1].isspace()
+        return "".join(parts)
 
     def _truncate_content(self, content: str) -> str:
         # Simple truncation by character count for now
@@ -16,6 +16,43 @@ def build_classification_prompt(
     return prompt
 
 
+def build_combined_prompt(
+    content: str, filename: str, folder_paths: dict[str, str]
+) -> str:
+    folder_info = "\n".join(f"{path}: {desc}" for path, desc in folder_paths.items())
+
+    prompt = (
+        f"{COMBINED_PROMPT}"
+        f"Folders:\n{folder_info}\n\n"
+        f"Input:\nFilename: {filename}\nContent:\n{content}\nOutput:"
+    )
+    return prompt
+
+
+def build_batch_summarization_prompt(contents: list[str]) -> str:
+    files = "\n\n".join(f"File {i}:\n{content}" for i, content in enumerate(contents))
+    return f"{BATCH_SUMMARIZATION_PROMPT}{files}"
+
+
+def build_batch_classification_prompt(
+    files: list[tuple[str, str]], folder_paths: dict[str, str]
+) -> str:
+    folder_info = "\n".join(f"{path}: {desc}" for path, desc in folder_paths.items())
+    inputs = "\n\n".join(
+        f"Input {i}:\nFilename: {filename}\nSummary: {summary}"
+        for i, (filename, summary) in enumerate(files)
+    )
+
+    prompt = (
+        f"{CLASSIFICATION_PROMPT}"
+        f"Folders:\n{folder_info}\n\n"
+        f"{CLASSIFICATION_EXAMPLES_SNIPPET}\n"
+        f"{BATCH_CLASSIFICATION_PROMPT}"
+        f"{inputs}\nOutput:"
+    )
+    return prompt
+
+
 SUMMARIZATION_PROMPT = """
 Summarize the following file in 300 words or less.
 
@@ -72,3 +109,24 @@ Folders:
 Output:
 /academics/spring2024/eng150/writings
 """
+
+COMBINED_PROMPT = """
+You will be given a file name and the contents of the file.
+First summarize the contents briefly, then classify the file into exactly one of the following folders.
+If no folder matches appropriately, use PATH_NOT_FOUND as the folder.
+Be quite liberal with the classification. PATH_NOT_FOUND should be used conservatively.
+Respond with only a JSON object of the form {"summary": "<summary>", "folder": "<folder>"}.
+
+"""
+
+BATCH_SUMMARIZATION_PROMPT = """
+Summarize each of the following files briefly.
+Respond with only a JSON array containing one object per file, in the form {"id": <file number>, "summary": "<summary>"}.
+
+"""
+
+BATCH_CLASSIFICATION_PROMPT = """
+Now classify each of the following inputs in the same way.
+Respond with only a JSON array containing one object per input, in the form {"id": <input number>, "folder": "<folder>"}.
+
+"""
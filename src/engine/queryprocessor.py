@@ -1,40 +1,207 @@
 from __future__ import annotations
 
-import datetime as dt
-from pathlib import Path
+import base64
+import hashlib
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
 
 from engine.db.database import VectorDatabase
+from engine.db.filters import QueryFilters
 from engine.db.models import File
+from engine.validator import MetadataValidator
+from settings import settings
+
+# Upper bound on the candidates fetched for a paged query
+MAX_FETCH = 1000
+MAX_PAGED_QUERIES = 64
+
+
+class InvalidCursorError(ValueError):
+    """The cursor is malformed or belongs to a different query"""
+
+
+class QueryCache:
+    """
+    LRU cache of query results and their candidate counts. An entry is only
+    served while the database is at the generation it was computed for and
+    younger than the TTL, since the file metadata in it may since have been
+    corrected by the validator.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[tuple, tuple] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, generation: int) -> tuple[list[File], int] | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry_generation, created_at, files = entry
+            if (
+                entry_generation != generation
+                or time.monotonic() - created_at > self.ttl
+            ):
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return files
+
+    def put(self, key: tuple, generation: int, files: tuple[list[File], int]):
+        with self.lock:
+            self.entries[key] = (generation, time.monotonic(), files)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class ResultPages:
+    """Results served so far for a paged query, in the order they were served"""
+
+    def __init__(self, session: str):
+        self.session = session
+        self.files: list[File] = []
+        self.paths: set[str] = set()
+        self.fetched = 0
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    def add(self, files: list[File]):
+        # Larger fetches can reorder results, so only append the unseen ones
+        for file in files:
+            path = os.path.normcase(file.path)
+            if path not in self.paths:
+                self.paths.add(path)
+                self.files.append(file)
 
 
 class QueryProcessor:
     def __init__(self, db: VectorDatabase) -> None:
         self.db = db
+        query_cache = settings.get_query_cache()
+        self.cache = QueryCache(query_cache["max_entries"], query_cache["ttl"])
+        self.validator = MetadataValidator(db)
+        self.pages: OrderedDict[str, ResultPages] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def process_query(
+        self,
+        query: str,
+        return_length: int = 5,
+        filters: QueryFilters | None = None,
+    ) -> list[File]:
+        return self.__query(query, return_length, filters or QueryFilters())[0]
+
+    def process_query_page(
+        self,
+        query: str,
+        page_size: int = 5,
+        cursor: str | None = None,
+        filters: QueryFilters | None = None,
+    ) -> tuple[list[File], str | None]:
+        """
+        A page of results and the cursor of the next page, None on the last one.
+        Results are kept per cursor so that pages never overlap, and candidates
+        are over-fetched until the page is full after dropping duplicates and
+        stale rows.
+        """
+        filters = filters or QueryFilters()
+        fingerprint = self.__fingerprint(query, filters)
+        results, offset = None, 0
+        if cursor is not None:
+            session, offset = self.__decode_cursor(cursor, fingerprint)
+            with self.lock:
+                results = self.pages.get(session)
+                if results is not None:
+                    self.pages.move_to_end(session)
+        if results is None:
+            # New query, or its results were evicted since the last page
+            results = ResultPages(secrets.token_hex(8))
+            with self.lock:
+                self.pages[results.session] = results
+                while len(self.pages) > MAX_PAGED_QUERIES:
+                    self.pages.popitem(last=False)
+
+        with results.lock:
+            # One extra result tells whether there is a next page
+            wanted = offset + page_size + 1
+            while len(results.files) < wanted and not results.exhausted:
+                self.__fetch_more(results, query, wanted, filters)
+            page = results.files[offset : offset + page_size]
+            has_more = len(results.files) > offset + page_size
+        if not has_more:
+            return page, None
+        return page, self.__encode_cursor(
+            fingerprint, results.session, offset + page_size
+        )
+
+    def __fetch_more(
+        self, results: ResultPages, query: str, wanted: int, filters: QueryFilters
+    ):
+        # Ask for as many candidates as the ratio of candidates to results so far
+        # says are needed, and at least twice as many as last time
+        ratio = results.fetched / len(results.files) if results.files else 1.0
+        fetch = max(math.ceil(wanted * ratio), results.fetched * 2, wanted)
+        fetch = min(MAX_FETCH, fetch)
+        files, candidates = self.__query(query, fetch, filters)
+        results.add(files)
+        results.fetched = fetch
+        # Counted before stale and duplicate rows are dropped, fewer candidates
+        # than asked for means the database ran out of matches
+        results.exhausted = candidates < fetch or fetch >= MAX_FETCH
 
-    def process_query(self, query: str, return_length: int = 5) -> list[File]:
-        files = self.db.get_query_results(query, return_length)
+    def __query(
+        self, query: str, limit: int, filters: QueryFilters
+    ) -> tuple[list[File], int]:
+        """Deduplicated results, and the number of candidates the database ranked"""
+        key = (" ".join(query.lower().split()), limit, filters.key())
+        # Read the generation first so a concurrent write invalidates this result
+        generation = self.db.generation
+        cached = self.cache.get(key, generation)
+        if cached is not None:
+            return cached
+
+        files, candidates = self.db.get_ranked_results(query, limit, filters)
         res = []
         seen = set()
-        cleanup = []
-        for id, file in files.items():
-            path = Path(file.path).resolve()
+        for file in files.values():
+            # Rows from before ids were stable can point at the same file
+            path = os.path.normcase(file.path)
             if path in seen:
-                cleanup.append(id)
                 continue
-            try:
-                stat = path.stat()
-                if not path.is_file():
-                    cleanup.append(id)
-                    continue
-                file.size_bytes = stat.st_size
-                file.created_at = dt.datetime.fromtimestamp(stat.st_ctime).isoformat()
-                file.modified_at = dt.datetime.fromtimestamp(stat.st_mtime).isoformat()
-                seen.add(path)
-                res.append(file)
-            except (FileNotFoundError, PermissionError, OSError):
-                cleanup.append(id)
-
-        if cleanup:
-            self.db.remove_entries(cleanup)
-
-        return res
+            seen.add(path)
+            res.append(file)
+
+        self.validator.submit(list(files.keys()))
+        self.cache.put(key, generation, (res, candidates))
+        return res, candidates
+
+    def __fingerprint(self, query: str, filters: QueryFilters) -> str:
+        key = json.dumps([" ".join(query.lower().split()), filters.key()])
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+
+    def __encode_cursor(self, fingerprint: str, session: str, offset: int) -> str:
+        cursor = json.dumps(
+            {"query": fingerprint, "session": session, "offset": offset}
+        )
+        return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+    def __decode_cursor(self, cursor: str, fingerprint: str) -> tuple[str, int]:
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            session, offset = str(decoded["session"]), int(decoded["offset"])
+            matches = decoded["query"] == fingerprint
+        except (ValueError, KeyError, TypeError) as e:
+            raise InvalidCursorError(f"Malformed cursor: {cursor}") from e
+        if not matches:
+            raise InvalidCursorError("Cursor belongs to a different query")
+        if offset < 0:
+            raise InvalidCursorError(f"Malformed cursor: {cursor}")
+        return session, offset
@@ -0,0 +1,167 @@
+import logging
+import os
+import stat
+import sys
+import threading
+import time
+
+from engine.cache import content_hash
+from engine.db.database import VectorDatabase, document_id
+from engine.watcher import File
+from settings import settings
+
+
+class Reconciler:
+    """
+    Walks the whole index in the background, purging rows whose file is gone
+    and re-pointing rows whose file was moved to a watched or destination
+    folder, matched by content hash. Runs at low priority with rate-limited
+    stats so it never competes with saving or querying.
+    """
+
+    def __init__(self, db: VectorDatabase, is_dead: threading.Event):
+        self.db = db
+        self.is_dead = is_dead
+        self.lock = threading.Lock()
+        self.progress = {
+            "running": False,
+            "scanned": 0,
+            "total": 0,
+            "purged": 0,
+            "repointed": 0,
+            "last_run": None,
+        }
+        self.stat_interval = 0.0
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def status(self) -> dict:
+        with self.lock:
+            return dict(self.progress)
+
+    def reconcile(self):
+        """Run a single pass over the index"""
+        config = settings.get_reconciler()
+        self.stat_interval = 1 / config["stats_per_second"]
+        ids = self.db.get_ids()
+        self.__update(running=True, scanned=0, total=len(ids), purged=0, repointed=0)
+        logging.info("Reconciling index with the filesystem")
+
+        missing = self.__find_missing(ids, config["page_size"])
+        if missing and not self.is_dead.is_set():
+            moved = self.__find_moved(missing)
+            # The walk takes a while, the file may have been re-created and
+            # re-ingested at the same path since, which reuses the row's id
+            missing = self.__still_missing(missing)
+            moved = {id: path for id, path in moved.items() if id in missing}
+            for id, path in moved.items():
+                self.db.move_entry(id, path)
+            purged = [id for id in missing if id not in moved]
+            if purged:
+                self.db.remove_entries(purged)
+            self.__update(purged=len(purged), repointed=len(moved))
+
+        self.__update(running=False, last_run=time.time())
+        progress = self.status()
+        logging.info(
+            f"Reconciled {progress['scanned']} index entries: "
+            f"{progress['purged']} purged, {progress['repointed']} re-pointed"
+        )
+
+    def __run(self):
+        self.__lower_priority()
+        while not self.is_dead.is_set():
+            try:
+                self.reconcile()
+            except Exception as e:
+                self.__update(running=False)
+                logging.error(f"Failed to reconcile index: {e}")
+            self.is_dead.wait(settings.get_reconciler()["interval"])
+
+    def __find_missing(self, ids: list[str], page_size: int) -> dict[str, dict]:
+        """Rows whose file no longer exists, keyed by id"""
+        missing = {}
+        revived = {}
+        # Paged over a snapshot of the ids, since ingestion writes concurrently
+        for start in range(0, len(ids), page_size):
+            if self.is_dead.is_set():
+                break
+            page = self.db.get_metadata(ids[start : start + page_size])
+            for id, metadata in page.items():
+                if not self.__is_file(metadata["path"]):
+                    missing[id] = metadata
+                elif metadata.get("stale"):
+                    # Flagged by the validator, but the file is back
+                    revived[id] = {**metadata, "stale": False}
+            self.__update(scanned=min(start + page_size, len(ids)))
+        if revived:
+            self.db.update_metadata(revived)
+        return missing
+
+    def __still_missing(self, missing: dict[str, dict]) -> dict[str, dict]:
+        """The rows of missing that still exist and whose file is still gone"""
+        current = self.db.get_metadata(list(missing.keys()))
+        return {
+            id: metadata
+            for id, metadata in current.items()
+            if not self.__is_file(metadata["path"])
+        }
+
+    def __find_moved(self, missing: dict[str, dict]) -> dict[str, str]:
+        """Map ids of missing rows to the path their content was moved to"""
+        by_size: dict[int, dict[str, str]] = {}
+        for id, metadata in missing.items():
+            if metadata.get("content_hash") and metadata.get("size_bytes") is not None:
+                by_size.setdefault(metadata["size_bytes"], {})[
+                    metadata["content_hash"]
+                ] = id
+        if not by_size:
+            return {}
+
+        roots = set(settings.get_watch_paths()) | set(settings.get_folder_paths())
+        moved = {}
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    if self.is_dead.is_set():
+                        return moved
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        size = self.__stat(path).st_size
+                    except OSError:
+                        continue
+                    if size not in by_size:
+                        continue
+                    try:
+                        digest = content_hash(File(filename, path))
+                    except OSError:
+                        continue
+                    id = by_size[size].pop(digest, None)
+                    # Don't clobber a row the file is already indexed under
+                    if id is not None and not self.db.get_metadata([document_id(path)]):
+                        moved[id] = path
+        return moved
+
+    def __is_file(self, path: str) -> bool:
+        try:
+            return stat.S_ISREG(self.__stat(path).st_mode)
+        except OSError:
+            return False
+
+    def __stat(self, path: str) -> os.stat_result:
+        time.sleep(self.stat_interval)
+        return os.stat(path)
+
+    def __update(self, **progress):
+        with self.lock:
+            self.progress.update(progress)
+
+    def __lower_priority(self):
+        # Linux applies the nice value to the calling thread only
+        if sys.platform.startswith("linux"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError as e:
+                logging.warning(f"Failed to lower reconciler priority: {e}")
@@ -1,10 +1,29 @@
+import logging
+import shutil
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
+from engine.cache import ResultCache, content_hash
 from engine.classifier import Classifier, Summarizer
 from engine.db.database import VectorDatabase
 from engine.preprocessor import Preprocessor
 from engine.watcher import File
+from settings import settings
+
+
+class Job:
+    """A single file travelling through the save stages"""
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+        self.submitted_at = time.monotonic()
+        self.file: File | None = None
+        self.content_hash: str | None = None
+        self.contents: str | None = None
+        self.summary: str | None = None
+        self.classified = False
+        self.new_path: str | None = None
 
 
 class SaveProcessor:
@@ -13,26 +32,147 @@ class SaveProcessor:
         db: VectorDatabase,
         token_threshold: Optional[int] = None,
     ) -> None:
-        self.classifier = Classifier()
+        self.classifier = Classifier(db)
         self.summarizer = Summarizer()
         self.db = db
         self.preprocessor = Preprocessor(token_threshold)
+        self.cache = ResultCache()
 
     def process_file(self, file: File) -> str | None:
-        # Preprocess the file into a string
-        contents = self.preprocessor.preprocess(file)
+        job = Job(Path(file.path))
+        job.file = file
+        self.lookup(job)
+        self.extract(job)
+        self.summarize(job)
+        self.classify(job)
+        self.store(job)
+        return job.new_path
+
+    # Stages, run in order by the pipeline
+
+    def read(self, job: Job) -> Job:
+        job.file = File(job.file_path.name, str(job.file_path))
+        return self.lookup(job)
+
+    def lookup(self, job: Job) -> Job:
+        """Fill in whatever results are cached for the file's content"""
+        job.content_hash = content_hash(job.file)
+        entry = self.cache.get(job.content_hash)
+        if entry is None:
+            return job
+        job.contents = entry.text
+        job.summary = entry.summary
+        if entry.is_classified(settings.get_folder_paths()):
+            job.classified = True
+            job.new_path = entry.folder
+        logging.info(f"Cache hit for {job.file_path}")
+        return job
+
+    def extract(
+        self, job: Job, preprocess: Callable[[File], str] | None = None
+    ) -> Job:
+        if job.contents is None:
+            preprocess = preprocess or self.preprocessor.preprocess
+            job.contents = preprocess(job.file)
+            self.cache.put_text(job.content_hash, job.contents)
+        return job
+
+    def summarize(self, job: Job) -> Job:
+        if job.summary is None and not job.classified:
+            if settings.get_combined_llm_call():
+                self.__summarize_and_classify(job)
+        if job.summary is None:
+            job.summary = self.summarizer.summarize(job.contents)
+            self.cache.put_summary(job.content_hash, job.summary)
+        return job
+
+    def summarize_batch(self, jobs: list[Job]) -> list[Job]:
+        if settings.get_combined_llm_call():
+            return self.__each("summarize", self.summarize, jobs)
+        pending = [job for job in jobs if job.summary is None]
+        failed = []
+        if pending:
+            summaries = self.summarizer.summarize_batch([j.contents for j in pending])
+            for job, summary in zip(pending, summaries):
+                if isinstance(summary, Exception):
+                    logging.error(f"[summarize] {job.file_path}: {summary}")
+                    failed.append(job)
+                    continue
+                job.summary = summary
+                self.cache.put_summary(job.content_hash, summary)
+        jobs = [job for job in jobs if job not in failed]
+        return self.__each("summarize", self.summarize, jobs)
+
+    def __each(
+        self, stage: str, fn: Callable[[Job], Job], jobs: list[Job]
+    ) -> list[Job]:
+        """fn of every job, logging and dropping the jobs it fails on"""
+        done = []
+        for job in jobs:
+            try:
+                done.append(fn(job))
+            except Exception as e:
+                logging.error(f"[{stage}] {job.file_path}: {e}")
+        return done
+
+    def __summarize_and_classify(self, job: Job):
+        folder_paths = settings.get_folder_paths()
+        try:
+            job.summary, job.new_path = self.classifier.summarize_and_classify(
+                job.file.basename, job.contents
+            )
+        except ValueError as e:
+            # Leave it to the separate summarize and classify calls
+            logging.warning(f"Falling back to separate calls for {job.file_path}: {e}")
+            return
+        job.classified = True
+        self.cache.put_summary(job.content_hash, job.summary)
+        self.cache.put_folder(job.content_hash, job.new_path, folder_paths)
 
-        # Summarize its content
-        summary = self.summarizer.summarize(contents)
+    def classify(self, job: Job) -> Job:
+        if job.classified:
+            # The folder may have been deleted since it was cached
+            if job.new_path and not Path(job.new_path).exists():
+                job.new_path = None
+        else:
+            folder_paths = settings.get_folder_paths()
+            job.new_path = self.classifier.classify(job.file.basename, job.summary)
+            self.cache.put_folder(job.content_hash, job.new_path, folder_paths)
+            job.classified = True
+        if job.new_path:
+            job.file.path = str(Path(job.new_path) / job.file.basename)
+        return job
 
-        # Classify the file
-        new_path = self.classifier.classify(file.basename, summary)
-        if new_path:
-            file.path = str(Path(new_path) / file.basename)
+    def classify_batch(self, jobs: list[Job]) -> list[Job]:
+        pending = [job for job in jobs if not job.classified]
+        failed = []
+        if pending:
+            folder_paths = settings.get_folder_paths()
+            new_paths = self.classifier.classify_batch(
+                [(job.file.basename, job.summary) for job in pending]
+            )
+            for job, new_path in zip(pending, new_paths):
+                if isinstance(new_path, Exception):
+                    logging.error(f"[classify] {job.file_path}: {new_path}")
+                    failed.append(job)
+                    continue
+                job.new_path = new_path
+                job.classified = True
+                self.cache.put_folder(job.content_hash, new_path, folder_paths)
+        jobs = [job for job in jobs if job not in failed]
+        return self.__each("classify", self.classify, jobs)
 
+    def store(self, job: Job) -> Job:
         # Save embedding + new file path into database
-        self.db.create_entry(file, summary)
+        self.db.create_entry(job.file, job.summary, job.content_hash, job.contents)
+        return job
 
-        # Classify file to determine target folder
-        # TODO: run in parallel with storing the embedding, possibly using multiprocessing
-        return new_path
+    def move(self, job: Job) -> Job:
+        # Move the file to the new folder if the path has changed. Raises rather
+        # than overwrite a file of the same name, before anything is stored.
+        if job.new_path is not None:
+            new_path = Path(job.new_path).resolve()
+            destination = shutil.move(job.file_path, new_path)
+            job.file.source_path = Path(destination)
+            logging.info(f"File moved to {new_path}")
+        return job
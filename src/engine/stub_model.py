@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+
+from engine.model_api import ModelBackend
+from engine.prompt_builder import (
+    BATCH_CLASSIFICATION_PROMPT,
+    BATCH_SUMMARIZATION_PROMPT,
+    CLASSIFICATION_PROMPT,
+    COMBINED_PROMPT,
+)
+from settings import settings
+
+SUMMARY_WORDS = 40
+
+
+def _digest(text: str) -> int:
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _split_items(text: str, label: str) -> list[str]:
+    """Split "<label> 0:\n...\n\n<label> 1:\n..." into the text of each item"""
+    if not text.startswith(f"{label} 0:\n"):
+        return []
+    text = text.removeprefix(f"{label} 0:\n")
+    items = []
+    while True:
+        # Only the separator says whether another item follows, the text left
+        # after it is empty when that item is
+        item, separator, text = text.partition(f"\n\n{label} {len(items) + 1}:\n")
+        items.append(item)
+        if not separator:
+            return items
+
+
+class StubModel(ModelBackend):
+    """
+    Offline stand-in for a model, for load tests and CI. Answers are derived from
+    a hash of the prompt so they are the same on every run, and are valid for
+    every prompt in engine.prompt_builder. Latency is drawn from a lognormal
+    distribution around latency_ms, and error_rate of the calls fail like a
+    failed API call would.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float,
+        latency_sigma: float,
+        error_rate: float,
+        seed: int | str,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def call(self, system_prompt: str) -> str:
+        delay, fail = self.__draw()
+        time.sleep(delay)
+        return self.__respond(system_prompt, fail)
+
+    async def acall(self, system_prompt: str) -> str:
+        delay, fail = self.__draw()
+        await asyncio.sleep(delay)
+        return self.__respond(system_prompt, fail)
+
+    def __draw(self) -> tuple[float, bool]:
+        with self.lock:
+            delay = (
+                self.random.lognormvariate(0, self.latency_sigma)
+                if self.latency_sigma
+                else 1.0
+            )
+            return (
+                delay * self.latency_ms / 1000,
+                self.random.random() < self.error_rate,
+            )
+
+    def __respond(self, prompt: str, fail: bool) -> str:
+        if fail:
+            raise RuntimeError("API call failed: stub error")
+        # Answers depend only on each file's own part of the prompt, so a file
+        # gets the same answer whether or not it was batched
+        if BATCH_SUMMARIZATION_PROMPT in prompt:
+            files = _split_items(prompt.split(BATCH_SUMMARIZATION_PROMPT, 1)[1], "File")
+            return json.dumps(
+                [{"id": i, "summary": self.__summary(f)} for i, f in enumerate(files)]
+            )
+        if BATCH_CLASSIFICATION_PROMPT in prompt:
+            inputs = prompt.split(BATCH_CLASSIFICATION_PROMPT, 1)[1]
+            inputs = _split_items(inputs.removesuffix("\nOutput:"), "Input")
+            return json.dumps(
+                [{"id": i, "folder": self.__folder(f)} for i, f in enumerate(inputs)]
+            )
+        if COMBINED_PROMPT in prompt:
+            content = prompt.rsplit("\nContent:\n", 1)[1].removesuffix("\nOutput:")
+            return json.dumps(
+                {"summary": self.__summary(content), "folder": self.__folder(content)}
+            )
+        if CLASSIFICATION_PROMPT in prompt:
+            return self.__folder(
+                prompt.rsplit("Input:\n", 1)[1].removesuffix("\nOutput:")
+            )
+        return self.__summary(prompt.split("\n\n", 1)[-1])
+
+    def __summary(self, content: str) -> str:
+        words = content.split()[:SUMMARY_WORDS]
+        return f"Stub summary {_digest(content) % 10000:04d}: {' '.join(words)}"
+
+    def __folder(self, key: str) -> str:
+        folders = sorted(settings.get_folder_paths())
+        choice = _digest(key) % (len(folders) + 1)
+        # One in every len(folders) + 1 files matches no folder
+        return folders[choice] if choice < len(folders) else "PATH_NOT_FOUND"
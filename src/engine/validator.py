@@ -0,0 +1,79 @@
+import logging
+import os
+import queue
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from engine.db.database import VectorDatabase
+
+BATCH_SIZE = 64
+# Don't check the same row again for this many seconds
+RECHECK_INTERVAL = 60.0
+MAX_TRACKED = 10000
+
+
+class MetadataValidator:
+    """
+    Checks rows returned by queries against the filesystem in the background.
+    Rows whose file is gone are flagged as stale, rows whose size or mtime
+    changed get fresh metadata. Queries never wait for this.
+    """
+
+    def __init__(self, db: VectorDatabase):
+        self.db = db
+        self.queue: queue.Queue[str] = queue.Queue()
+        self.checked_at: OrderedDict[str, float] = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def submit(self, ids: list[str]):
+        now = time.monotonic()
+        with self.lock:
+            for id in ids:
+                checked_at = self.checked_at.get(id)
+                if checked_at is not None and now - checked_at < RECHECK_INTERVAL:
+                    continue
+                self.checked_at[id] = now
+                self.checked_at.move_to_end(id)
+                self.queue.put(id)
+            while len(self.checked_at) > MAX_TRACKED:
+                self.checked_at.popitem(last=False)
+
+    def __run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.__validate(batch)
+            except Exception as e:
+                logging.error(f"Failed to validate index entries: {e}")
+
+    def __validate(self, ids: list[str]):
+        updates = {}
+        for id, metadata in self.db.get_metadata(ids).items():
+            try:
+                st = os.stat(metadata["path"])
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                updates[id] = {**metadata, "stale": True}
+            elif (
+                metadata.get("size_bytes") != st.st_size
+                or metadata.get("mtime") != st.st_mtime
+            ):
+                updates[id] = {
+                    **metadata,
+                    "size_bytes": st.st_size,
+                    "mtime": st.st_mtime,
+                    "ctime": st.st_ctime,
+                }
+        if updates:
+            self.db.update_metadata(updates)
+            logging.info(f"Updated metadata of {len(updates)} index entries")
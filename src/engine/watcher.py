@@ -1,52 +1,152 @@
 import logging
-import shutil
+import os
+import threading
+import time
 from pathlib import Path
+from typing import BinaryIO, Callable, Iterator
 
 from watchdog.events import FileSystemEventHandler
 
+from settings import settings
+from utils import TEMP_DOWNLOAD_EXTENSIONS
+
 
 class WatcherHandler(FileSystemEventHandler):
-    def __init__(self, saveprocessor):
+    def __init__(self, pipeline):
         super().__init__()
-        self.saveprocessor = saveprocessor
+        self.pipeline = pipeline
+        self.coalescer = EventCoalescer(self.process, settings.get_settle_window())
 
     def on_created(self, event):
-        self.handle_event(event)
+        self.handle_event(event.src_path)
 
     def on_modified(self, event):
-        self.handle_event(event)
-
-    def handle_event(self, event):
-        try:
-            file_path = Path(event.src_path).resolve()
-            if not file_path.is_file():
-                return
-            logging.info(f"Handle file: {file_path}")
-
-            # Create the file object
-            with open(file_path, "rb") as f:
-                content = f.read()
-            file_name = Path(file_path).name
-            file = File(content, file_name, str(file_path))
-
-            # Process the file using the saveprocessor
-            new_path = (
-                Path(path).resolve()
-                if (path := self.saveprocessor.process_file(file))
-                else None
-            )
-
-            # Move the file to the new folder if the path has changed
-            if new_path is not None:
-                shutil.move(file_path, new_path)
-                logging.info(f"File moved to {new_path}")
-        except Exception as e:
-            logging.error(e)
+        self.handle_event(event.src_path)
+
+    def on_moved(self, event):
+        # Browsers rename the finished download over the temporary file
+        self.handle_event(event.dest_path)
+
+    def handle_event(self, src_path: str):
+        file_path = Path(src_path).resolve()
+        if file_path.suffix.lower() in TEMP_DOWNLOAD_EXTENSIONS:
+            return
+        if not file_path.is_file():
+            return
+        self.coalescer.submit(file_path)
+
+    def stop(self):
+        self.coalescer.stop()
+
+    def process(self, file_path: Path):
+        # Only enqueue here, the pipeline does the heavy lifting
+        if not self.pipeline.submit(file_path):
+            logging.warning(f"Pipeline stopped, dropped file: {file_path}")
+
+
+class EventCoalescer:
+    """
+    Collapses bursts of events for the same path into a single callback.
+    A path is only handed to the callback once its size and mtime have stayed
+    the same for a full settle window.
+    """
+
+    def __init__(self, callback: Callable[[Path], None], settle_window: float):
+        self.callback = callback
+        self.settle_window = settle_window
+        self.pending: dict[Path, tuple[float, tuple[int, int] | None]] = {}
+        self.cond = threading.Condition()
+        self.is_dead = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def submit(self, path: Path):
+        """(Re)start the settle window for the path"""
+        with self.cond:
+            deadline = time.monotonic() + self.settle_window
+            self.pending[path] = (deadline, _snapshot(path))
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.is_dead = True
+            self.pending.clear()
+            self.cond.notify()
+        self.thread.join()
+
+    def __run(self):
+        while True:
+            with self.cond:
+                while not self.is_dead and not self.pending:
+                    self.cond.wait()
+                if self.is_dead:
+                    return
+                path, (deadline, snapshot) = min(
+                    self.pending.items(), key=lambda item: item[1][0]
+                )
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                del self.pending[path]
+
+            current = _snapshot(path)
+            if current is None:
+                # The file vanished or was renamed before it settled
+                continue
+            if current != snapshot:
+                # Still being written, wait for another full window
+                with self.cond:
+                    deadline = time.monotonic() + self.settle_window
+                    self.pending.setdefault(path, (deadline, current))
+                continue
+
+            try:
+                self.callback(path)
+            except Exception as e:
+                logging.error(e)
+
+
+def _snapshot(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.stat()
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
 
 
 class File:
-    def __init__(self, bytes: bytes, basename: str, abs_path: str):
-        self.content = bytes
+    """
+    A file on disk whose content is only read on demand.
+    `path` is where the file is indexed and may be changed once the file is
+    classified, reads always go to the location the file was found at.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, basename: str, abs_path: str):
         self.basename = basename
         self.path = abs_path
         self.extension = Path(basename).suffix
+        self.source_path = Path(abs_path)
+
+    @property
+    def size(self) -> int:
+        return self.stat().st_size
+
+    def stat(self) -> os.stat_result:
+        return self.source_path.stat()
+
+    def open(self) -> BinaryIO:
+        return open(self.source_path, "rb")
+
+    def read(self, start: int = 0, length: int | None = None) -> bytes:
+        """Read a byte range of the file, or the rest of it if length is None"""
+        with self.open() as f:
+            f.seek(start)
+            return f.read() if length is None else f.read(length)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self.open() as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
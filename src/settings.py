@@ -1,13 +1,47 @@
+import copy
 import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from json import JSONDecodeError
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Callable, Dict, List
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 BASE_DIR = Path(__file__).resolve().parent.parent
-CONFIG_FILE = BASE_DIR / "config.json"
+# Overridable so tests don't touch the real config
+CONFIG_FILE = Path(os.environ.get("MUNCHKIN_CONFIG", BASE_DIR / "config.json"))
+LOCK_FILE = CONFIG_FILE.with_name(CONFIG_FILE.name + ".lock")
 ASSETS_DIR = BASE_DIR / "assets"
 
 
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive lock shared by every process using the settings"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            # Retries for 10 seconds before raising
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 class Singleton(type):
     _instances = {}
 
@@ -18,53 +52,348 @@ class Singleton(type):
 
 
 class Settings(object, metaclass=Singleton):
+    """
+    config.json, shared by the daemon, CLI and GUI. Reads are served from an
+    in-memory snapshot that is only reloaded when the file changes on disk.
+    Writes replace the file atomically under an inter-process lock, so readers
+    never see it half written and concurrent writers don't drop each other's keys.
+    """
+
     def __init__(self):
         self.__config = {}
+        # (mtime, inode, size) of the file the snapshot was loaded from
+        self.__signature = None
+        self.__lock = threading.RLock()
+        self.__subscribers: list[Callable[[set[str]], None]] = []
         self.__pull()
 
+    def subscribe(self, callback: Callable[[set[str]], None]):
+        """Call callback with the changed keys whenever the config changes"""
+        with self.__lock:
+            self.__subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[set[str]], None]):
+        with self.__lock:
+            self.__subscribers.remove(callback)
+
     def get_gemini_api_key(self):
         self.__pull()
         return self.__config.get("gemini_api_key")
 
     def set_gemini_api_key(self, key: str):
-        self.__config["gemini_api_key"] = key
-        self.__push()
+        self.__set("gemini_api_key", key)
 
     def get_watch_paths(self) -> List[str]:
         self.__pull()
-        return self.__config.get("watch_paths", [])
+        return list(self.__config.get("watch_paths", []))
 
     def set_watch_paths(self, paths: List[str]):
-        self.__config["watch_paths"] = paths
-        self.__push()
+        self.__set("watch_paths", paths)
 
     def get_folder_paths(self) -> Dict[str, str]:
         self.__pull()
-        return self.__config.get("folder_paths", {})
+        return dict(self.__config.get("folder_paths", {}))
 
     def set_folder_paths(self, paths: Dict[str, str]):
-        self.__config["folder_paths"] = paths
-        self.__push()
+        self.__set("folder_paths", paths)
 
     def get_daemon_port(self):
         self.__pull()
         return self.__config.get("daemon_port", 8000)
 
     def set_daemon_port(self, port: int):
-        self.__config["daemon_port"] = port
+        self.__set("daemon_port", port)
+
+    def get_settle_window(self) -> float:
+        """Seconds a file must stay unchanged before it is processed."""
+        self.__pull()
+        return self.__config.get("settle_window", 2.0)
+
+    def set_settle_window(self, seconds: float):
+        self.__set("settle_window", seconds)
+
+    def get_pipeline_workers(self) -> Dict[str, int]:
+        """Worker count per ingestion stage, see engine.pipeline"""
+        self.__pull()
+        workers = {"extract": 2, "summarize": 4, "classify": 4, "store": 1}
+        workers.update(self.__config.get("pipeline_workers", {}))
+        return workers
+
+    def set_pipeline_workers(self, workers: Dict[str, int]):
+        self.__set("pipeline_workers", workers)
+
+    def get_pipeline_queue_size(self) -> int:
+        self.__pull()
+        return self.__config.get("pipeline_queue_size", 64)
+
+    def set_pipeline_queue_size(self, size: int):
+        self.__set("pipeline_queue_size", size)
+
+    def get_extraction_limits(self) -> Dict[str, float]:
+        """Per-file timeout, worker memory cap and jobs before a worker is recycled"""
+        self.__pull()
+        limits = {"timeout": 60, "memory_mb": 1024, "max_jobs": 100}
+        limits.update(self.__config.get("extraction_limits", {}))
+        return limits
+
+    def set_extraction_limits(self, limits: Dict[str, float]):
+        self.__set("extraction_limits", limits)
+
+    def get_token_threshold(self) -> int | None:
+        """Characters of text extracted from a file, None to read files in full"""
+        self.__pull()
+        return self.__config.get("token_threshold", 32000)
+
+    def set_token_threshold(self, threshold: int | None):
+        self.__set("token_threshold", threshold)
+
+    def get_combined_llm_call(self) -> bool:
+        """Summarize and classify a file with a single model call"""
+        self.__pull()
+        return self.__config.get("combined_llm_call", False)
+
+    def set_combined_llm_call(self, enabled: bool):
+        self.__set("combined_llm_call", enabled)
+
+    def get_llm_batching(self) -> Dict[str, int]:
+        """Files per batched model call and how long to wait for a batch to fill"""
+        self.__pull()
+        batching = {"size": 1, "wait_ms": 200}
+        batching.update(self.__config.get("llm_batching", {}))
+        return batching
+
+    def set_llm_batching(self, batching: Dict[str, int]):
+        self.__set("llm_batching", batching)
+
+    def get_model_backend(self) -> Dict[str, Any]:
+        """
+        Which model summarizes and classifies files: "gemini" over HTTP, or
+        "stub", an offline model with simulated latency and errors for testing
+        """
+        self.__pull()
+        backend = {
+            "name": "gemini",
+            "model_name": "gemini-2.0-flash",
+            "stub": {
+                "latency_ms": 300,
+                "latency_sigma": 0.5,
+                "error_rate": 0.0,
+                "seed": 0,
+            },
+        }
+        configured = self.__config.get("model_backend", {})
+        stub = {**backend["stub"], **configured.get("stub", {})}
+        backend.update(configured)
+        backend["stub"] = stub
+        return backend
+
+    def set_model_backend(self, backend: Dict[str, Any]):
+        self.__set("model_backend", backend)
+
+    def get_model_http(self) -> Dict:
+        """Endpoint, timeouts, retry and circuit breaker settings for ModelAPI"""
+        self.__pull()
+        http = {
+            "endpoint": "https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent",
+            "connect_timeout": 5,
+            "read_timeout": 60,
+            "max_retries": 4,
+            "backoff_base": 0.5,
+            "backoff_max": 30,
+            "breaker_threshold": 5,
+            "breaker_cooldown": 30,
+            "pool_size": 16,
+            "max_in_flight": 32,
+            "rate_limit_per_minute": 1000,
+            "burst": 10,
+        }
+        http.update(self.__config.get("model_http", {}))
+        return http
+
+    def set_model_http(self, http: Dict):
+        self.__set("model_http", http)
+
+    def get_write_buffer(self) -> Dict[str, float]:
+        """Entries and seconds to buffer before writing to the vector database"""
+        self.__pull()
+        write_buffer = {"max_entries": 32, "max_age": 2.0}
+        write_buffer.update(self.__config.get("write_buffer", {}))
+        return write_buffer
+
+    def set_write_buffer(self, write_buffer: Dict[str, float]):
+        self.__set("write_buffer", write_buffer)
+
+    def get_query_cache(self) -> Dict[str, float]:
+        """Size of the query result cache and how long file metadata stays fresh"""
+        self.__pull()
+        query_cache = {"max_entries": 256, "ttl": 30.0}
+        query_cache.update(self.__config.get("query_cache", {}))
+        return query_cache
+
+    def set_query_cache(self, query_cache: Dict[str, float]):
+        self.__set("query_cache", query_cache)
+
+    def get_embedding(self) -> Dict[str, Any]:
+        """Embedding model used for the index, and how it is run"""
+        self.__pull()
+        embedding = {
+            "model": "all-MiniLM-L6-v2",
+            "batch_size": 32,
+            "threads": 0,
+            "query_cache_size": 512,
+        }
+        embedding.update(self.__config.get("embedding", {}))
+        return embedding
+
+    def set_embedding(self, embedding: Dict[str, Any]):
+        self.__set("embedding", embedding)
+
+    def get_embedding_classification(self) -> Dict[str, Any]:
+        """
+        Whether files are classified by embedding similarity to the folder
+        descriptions, without a model call, when the best folder's cosine
+        similarity beats the runner-up's by at least margin
+        """
+        self.__pull()
+        embedding_classification = {
+            "enabled": False,
+            "margin": 0.1,
+            "min_similarity": 0.3,
+        }
+        embedding_classification.update(
+            self.__config.get("embedding_classification", {})
+        )
+        return embedding_classification
+
+    def set_embedding_classification(self, embedding_classification: Dict[str, Any]):
+        self.__set("embedding_classification", embedding_classification)
+
+    def get_local_classifier(self) -> Dict[str, Any]:
+        """
+        Whether files are classified offline by the nearest centroid of the files
+        already in each folder, for folders with at least min_examples files
+        """
+        self.__pull()
+        local_classifier = {
+            "enabled": False,
+            "min_examples": 5,
+            "margin": 0.05,
+            "min_similarity": 0.3,
+        }
+        local_classifier.update(self.__config.get("local_classifier", {}))
+        return local_classifier
 
-    def __push(self):
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(self.__config, f, indent=4)
+    def set_local_classifier(self, local_classifier: Dict[str, Any]):
+        self.__set("local_classifier", local_classifier)
+
+    def get_chunk_index(self) -> Dict[str, Any]:
+        """
+        Whether file contents are indexed as overlapping chunks of words next to
+        the summary, and whether chunk scores are combined per file by max or sum
+        """
+        self.__pull()
+        chunk_index = {
+            "enabled": False,
+            "words": 150,
+            "overlap": 30,
+            "max_chunks": 64,
+            "aggregation": "max",
+        }
+        chunk_index.update(self.__config.get("chunk_index", {}))
+        return chunk_index
+
+    def set_chunk_index(self, chunk_index: Dict[str, Any]):
+        self.__set("chunk_index", chunk_index)
+
+    def get_reconciler(self) -> Dict[str, float]:
+        """How often the index is reconciled with the filesystem, and how gently"""
+        self.__pull()
+        reconciler = {"interval": 3600, "page_size": 256, "stats_per_second": 200}
+        reconciler.update(self.__config.get("reconciler", {}))
+        return reconciler
+
+    def set_reconciler(self, reconciler: Dict[str, float]):
+        self.__set("reconciler", reconciler)
+
+    def get_cache_max_bytes(self) -> int:
+        self.__pull()
+        return self.__config.get("cache_max_bytes", 64 * 1024 * 1024)
+
+    def set_cache_max_bytes(self, size: int):
+        self.__set("cache_max_bytes", size)
+
+    def __set(self, key: str, value: Any):
+        with self.__lock, _file_lock(LOCK_FILE):
+            # Start from the file, another process may have changed other keys
+            old = self.__read()
+            # Copied so the caller mutating value can't change the snapshot
+            config = {**old, key: copy.deepcopy(value)}
+            self.__write(config)
+            self.__config = config
+            self.__signature = self.__stat()
+        self.__notify(old, config)
+
+    def __write(self, config: dict):
+        fd, tmp = tempfile.mkstemp(dir=CONFIG_FILE.parent, prefix=".config.")
+        try:
+            # mkstemp creates the file private, keep the permissions it had
+            if CONFIG_FILE.exists():
+                os.chmod(tmp, CONFIG_FILE.stat().st_mode & 0o777)
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, CONFIG_FILE)
+        except BaseException:
+            os.unlink(tmp)
+            raise
 
     def __pull(self):
+        with self.__lock:
+            signature = self.__stat()
+            if signature == self.__signature:
+                return
+            old = self.__config
+            new = self.__config = self.__read()
+            self.__signature = signature
+        self.__notify(old, new)
+
+    def __read(self) -> dict:
         try:
             with open(CONFIG_FILE, "r") as f:
-                self.__config = json.load(f)
-        except (FileNotFoundError, JSONDecodeError):
-            self.__config = {}
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except JSONDecodeError as e:
+            # Only possible if the file was edited by hand, keep what we had
+            logging.error(f"Failed to parse {CONFIG_FILE}: {e}")
+            return self.__config
+
+    def __stat(self) -> tuple[int, int, int] | None:
+        try:
+            stat = os.stat(CONFIG_FILE)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+    def __notify(self, old: dict, new: dict):
+        changed = {
+            key for key in old.keys() | new.keys() if old.get(key) != new.get(key)
+        }
+        if not changed:
+            return
+        with self.__lock:
+            subscribers = list(self.__subscribers)
+        for callback in subscribers:
+            try:
+                callback(changed)
+            except Exception as e:
+                logging.error(f"Settings subscriber failed: {e}")
 
 
 settings = Settings()
-if settings.get_gemini_api_key() is None:
+if (
+    settings.get_model_backend()["name"] == "gemini"
+    and settings.get_gemini_api_key() is None
+):
     settings.set_gemini_api_key(input("Please enter the gemini api key: "))
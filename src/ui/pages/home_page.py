@@ -1,9 +1,12 @@
 import os
 import subprocess
 import sys
+import time
 
 from PySide6.QtCore import Qt
 from PySide6.QtWidgets import (
+    QComboBox,
+    QHBoxLayout,
     QLineEdit,
     QListWidget,
     QListWidgetItem,
@@ -12,9 +15,30 @@ from PySide6.QtWidgets import (
     QWidget,
 )
 
-from api.find import find
+import api.assoc
+from api.find import find_page
+from settings import settings
 from ui.widgets.file_card import FileCard
 
+DAY = 24 * 60 * 60
+MB = 1024 * 1024
+# Label, seconds since the last modification
+MODIFIED_FILTERS = [
+    ("Any time", None),
+    ("Past day", DAY),
+    ("Past week", 7 * DAY),
+    ("Past month", 30 * DAY),
+    ("Past year", 365 * DAY),
+]
+PAGE_SIZE = 10
+# Label, (min_size, max_size)
+SIZE_FILTERS = [
+    ("Any size", (None, None)),
+    ("Under 1 MB", (None, MB)),
+    ("1 – 100 MB", (MB, 100 * MB)),
+    ("Over 100 MB", (100 * MB, None)),
+]
+
 
 class HomePage(QWidget):
     """Search‑and‑results view.
@@ -45,11 +69,57 @@ class HomePage(QWidget):
         self.search_edit.returnPressed.connect(self._handle_search)
         lay.addWidget(self.search_edit)
 
+        # ── Filters ──────────────────────────────────────────────────────────
+        filters = QHBoxLayout()
+        self.extension_edit = QLineEdit(placeholderText="Extension, e.g. pdf")
+        self.extension_edit.returnPressed.connect(self._handle_search)
+        filters.addWidget(self.extension_edit)
+
+        self.folder_combo = QComboBox()
+        filters.addWidget(self.folder_combo, 1)
+
+        self.modified_combo = QComboBox()
+        for label, age in MODIFIED_FILTERS:
+            self.modified_combo.addItem(label, age)
+        filters.addWidget(self.modified_combo)
+
+        self.size_combo = QComboBox()
+        for label, bounds in SIZE_FILTERS:
+            self.size_combo.addItem(label, bounds)
+        filters.addWidget(self.size_combo)
+
+        for combo in (self.folder_combo, self.modified_combo, self.size_combo):
+            combo.activated.connect(self._handle_search)
+        lay.addLayout(filters)
+
         # ── Results list ──────────────────────────────────────────────────────
         self.results = QListWidget()
         self.results.itemDoubleClicked.connect(self._handle_open)
+        # Fetch the next page when scrolled to the bottom
+        self.results.verticalScrollBar().valueChanged.connect(self._handle_scroll)
         lay.addWidget(self.results)
 
+        # Query and filters of the current results, and where they continue
+        self._search_args = None
+        self._cursor = None
+
+    def resizeEvent(self, event):
+        """Fetch more results if the list no longer overflows."""
+        super().resizeEvent(event)
+        self._fill_results()
+
+    def showEvent(self, event):
+        """Offer the folders configured since the page was last shown."""
+        super().showEvent(event)
+        current = self.folder_combo.currentData()
+        self.folder_combo.clear()
+        self.folder_combo.addItem("Any folder", None)
+        folders = list(api.assoc.list()) + settings.get_watch_paths()
+        for folder in dict.fromkeys(folders):
+            self.folder_combo.addItem(folder, folder)
+        index = self.folder_combo.findData(current)
+        self.folder_combo.setCurrentIndex(max(index, 0))
+
     # ── Internal helpers ─────────────────────────────────────────────────────
     def _handle_search(self):
         """Invoke external search callback and render its results."""
@@ -57,14 +127,57 @@ class HomePage(QWidget):
         if not query:
             return
 
-        matches, err = find(query)
+        age = self.modified_combo.currentData()
+        # Rounded to the minute so repeated searches hit the daemon's cache
+        now = time.time() // 60 * 60
+        min_size, max_size = self.size_combo.currentData()
+        self._search_args = dict(
+            query=query,
+            page_size=PAGE_SIZE,
+            extension=self.extension_edit.text().strip() or None,
+            folder=self.folder_combo.currentData(),
+            min_size=min_size,
+            max_size=max_size,
+            modified_after=now - age if age is not None else None,
+        )
+        self._cursor = None
+        matches = self._fetch_page()
+        if matches is not None:
+            self._render_results(matches)
+            self._fill_results()
+
+    def _handle_scroll(self, value: int):
+        """Append the next page once the last results come into view."""
+        if self._cursor is None or value < self.results.verticalScrollBar().maximum():
+            return
+        matches = self._fetch_page()
+        if matches:
+            self._append_results(matches)
+
+    def _fill_results(self):
+        """Append pages until the list overflows, so scrolling can fetch more."""
+        scrollbar = self.results.verticalScrollBar()
+        while self._cursor is not None:
+            # The scrollbar range is only updated once the items are laid out
+            self.results.doItemsLayout()
+            if scrollbar.maximum() > 0:
+                return
+            matches = self._fetch_page()
+            if not matches:
+                return
+            self._append_results(matches)
+
+    def _fetch_page(self):
+        """Fetch the page at the current cursor, or None after an error."""
+        matches, cursor, err = find_page(cursor=self._cursor, **self._search_args)
+        # Stop paging on errors so scrolling doesn't repeat them
+        self._cursor = cursor
         if err:
             QMessageBox.critical(
                 self, "Error searching", f"Error searching for file: {err}"
             )
-            return
-
-        self._render_results(matches)
+            return None
+        return matches
 
     def _render_results(self, files):
         """Populate the QListWidget with FileCard widgets."""
@@ -74,6 +187,10 @@ class HomePage(QWidget):
             empty.setFlags(Qt.ItemFlag.ItemIsEnabled)  # non‑selectable label
             self.results.addItem(empty)
             return
+        self._append_results(files)
+
+    def _append_results(self, files):
+        """Add FileCard widgets for files below the current results."""
         for file_obj in files:
             card = FileCard(file_obj)
             item = QListWidgetItem(listview=self.results)
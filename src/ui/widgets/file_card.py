@@ -60,7 +60,7 @@ class FileCard(QWidget):
     # ── Helper methods ──────────────────────────────────────────────────────
     def _build_meta_string(self, file: dict[str, str]) -> str:
         """Safely build the *size • modified* string."""
-        size_kb = int(file.get("size_bytes", 0)) / 1024
+        size_kb = int(file.get("size_bytes") or 0) / 1024
         mtime = self._resolve_mtime(file)
         parts: list[str] = []
         if size_kb is not None:
@@ -26,3 +26,10 @@ SUPPORTED_TEXT_EXTENSIONS = [
     ".pdf",
     ".docx",
 ]
+
+# Partial files written by browsers and download managers while in progress
+TEMP_DOWNLOAD_EXTENSIONS = [
+    ".crdownload",
+    ".part",
+    ".tmp",
+]
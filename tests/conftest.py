@@ -0,0 +1,9 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# settings reads its config, and prompts for an api key, as soon as it's imported
+_config_dir = Path(tempfile.mkdtemp(prefix="munchkin-tests-"))
+os.environ["MUNCHKIN_CONFIG"] = str(_config_dir / "config.json")
+(_config_dir / "config.json").write_text(json.dumps({"gemini_api_key": "test"}))
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from engine.model_api import ModelAPI
+from settings import settings
+
+OK_BODY = b'{"candidates": [{"content": {"parts": [{"text": "ok"}]}}]}'
+
+
+class StubServer:
+    """Local stand-in for the API, answering each request with the next response"""
+
+    def __init__(self, responses: list[str]):
+        self.responses = list(responses)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                kind = stub.responses.pop(0)
+                if kind == "slow":
+                    time.sleep(1)
+                if kind == "unavailable":
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif kind == "broken":
+                    # Chunked body with an invalid chunk size
+                    self.send_response(200)
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    self.wfile.write(b"zz\r\n")
+                    self.close_connection = True
+                else:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(OK_BODY)))
+                    self.end_headers()
+                    self.wfile.write(OK_BODY)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}/{{model_name}}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def model_http():
+    original = settings.get_model_http()
+    settings.set_model_http(
+        {
+            **original,
+            "max_retries": 0,
+            "breaker_threshold": 1,
+            "breaker_cooldown": 0,
+        }
+    )
+    yield
+    settings.set_model_http(original)
+
+
+def test_half_open_trial_failing_with_truncated_response(model_http):
+    with StubServer(["unavailable", "broken", "ok"]) as server:
+        model = ModelAPI("test", endpoint_base=server.endpoint)
+        with pytest.raises(RuntimeError):
+            model.call("prompt")
+        assert model.breaker.opened_at is not None
+
+        with pytest.raises(RuntimeError):
+            model.call("prompt")
+        assert not model.breaker.trial_running
+
+        assert model.call("prompt") == "ok"
+        assert model.breaker.opened_at is None
+
+
+def test_truncated_response_is_retried(model_http):
+    settings.set_model_http({**settings.get_model_http(), "max_retries": 1})
+    with StubServer(["broken", "ok"]) as server:
+        model = ModelAPI("test", endpoint_base=server.endpoint)
+        assert model.call("prompt") == "ok"
+
+
+def test_async_half_open_trial_cancelled(model_http):
+    async def run(model: ModelAPI):
+        with pytest.raises(RuntimeError):
+            await model.acall("prompt")
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(model.acall("prompt"), 0.2)
+        assert not model.breaker.trial_running
+        return await model.acall("prompt")
+
+    with StubServer(["unavailable", "slow", "ok"]) as server:
+        model = ModelAPI("test", endpoint_base=server.endpoint)
+        assert asyncio.run(run(model)) == "ok"
+        assert model.breaker.opened_at is None
+
+
+def test_cancelled_calls_do_not_open_the_circuit(model_http):
+    async def run(model: ModelAPI):
+        calls = [asyncio.create_task(model.acall("prompt")) for _ in range(3)]
+        await asyncio.sleep(0.2)
+        for call in calls:
+            call.cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+        assert model.breaker.failures == 0
+        assert model.breaker.opened_at is None
+        return await model.acall("prompt")
+
+    with StubServer(["slow", "slow", "slow", "ok"]) as server:
+        model = ModelAPI("test", endpoint_base=server.endpoint)
+        assert asyncio.run(run(model)) == "ok"